@@ -0,0 +1,151 @@
+"""Compare the atlas query with and without pushdown on synthetic Tahoe-like data.
+
+Run with::
+
+    python benchmarks/atlas_query.py --n-plates 4 --n-cells-per-plate 500000
+
+Increase `--n-cells-per-plate` to obtain parquet and h5ad files of several GB.
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import anndata as ad
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as pds
+import pyarrow.parquet as pq
+import scipy.sparse as sp
+from lamin_usecases import atlas
+
+CELL_LINES = [f"cell_line_{i}" for i in range(50)]
+DRUGS = [f"drug_{i}" for i in range(380)]
+
+
+def write_atlas(
+    directory: Path, n_plates: int, n_cells: int, n_vars: int, seed: int = 0
+) -> Path:
+    """Write one `.h5ad` per plate and a parquet file with the metadata of all cells."""
+    rng = np.random.default_rng(seed)
+    parquet_path = directory / "obs_metadata.parquet"
+    writer = None
+    for i in range(n_plates):
+        plate = f"plate{i}"
+        barcodes = np.char.add(f"{plate}_", np.arange(n_cells).astype(str))
+        obs = pd.DataFrame(
+            {
+                "plate": plate,
+                "BARCODE_SUB_LIB_ID": barcodes,
+                "cell_name": rng.choice(CELL_LINES, n_cells),
+                "drug": rng.choice(DRUGS, n_cells),
+                "sample": rng.choice([f"sample_{j}" for j in range(96)], n_cells),
+                "gene_count": rng.integers(200, 8000, n_cells),
+                "tscp_count": rng.integers(500, 50000, n_cells),
+                "mread_count": rng.integers(500, 80000, n_cells),
+                "pcnt_mito": rng.random(n_cells),
+                "S_score": rng.normal(size=n_cells),
+                "G2M_score": rng.normal(size=n_cells),
+                "phase": rng.choice(["G1", "S", "G2M"], n_cells),
+            }
+        )
+        table = pa.Table.from_pandas(obs, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(parquet_path, table.schema)
+        writer.write_table(table, row_group_size=100_000)
+
+        X = sp.random(
+            n_cells,
+            n_vars,
+            density=0.02,
+            format="csr",
+            dtype=np.float32,
+            random_state=rng,
+        )
+        adata = ad.AnnData(
+            X=X,
+            obs=pd.DataFrame(index=barcodes),
+            var=pd.DataFrame(index=[f"gene{j}" for j in range(n_vars)]),
+        )
+        adata.write_h5ad(directory / f"{plate}.h5ad")
+    writer.close()
+    return parquet_path
+
+
+def query_full_scan(
+    parquet_path: Path, cell_line: str, drug: str
+) -> dict[str, list[str]]:
+    """The current path: read the whole parquet file and filter in pandas."""
+    obs_df = pds.dataset(parquet_path).to_table().to_pandas()
+    obs_df = obs_df[(obs_df["cell_name"] == cell_line) & (obs_df["drug"] == drug)]
+    return obs_df.groupby("plate")["BARCODE_SUB_LIB_ID"].apply(list).to_dict()
+
+
+def query_pushdown(
+    parquet_path: Path, cell_line: str, drug: str
+) -> dict[str, list[str]]:
+    filter_expr = (pc.field("cell_name") == cell_line) & (pc.field("drug") == drug)
+    groups = atlas.query_parquet(
+        pds.dataset(parquet_path),
+        filter_expr,
+        by="plate",
+        columns=["BARCODE_SUB_LIB_ID"],
+    )
+    return {plate: df["BARCODE_SUB_LIB_ID"].tolist() for plate, df in groups.items()}
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--n-plates", type=int, default=4)
+    parser.add_argument("--n-cells-per-plate", type=int, default=500_000)
+    parser.add_argument("--n-vars", type=int, default=2_000)
+    parser.add_argument("--max-gap", type=int, default=256)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        parquet_path = write_atlas(
+            directory, args.n_plates, args.n_cells_per_plate, args.n_vars
+        )
+        cell_line, drug = CELL_LINES[0], DRUGS[0]
+
+        cells_scan, t_scan = timed(query_full_scan, parquet_path, cell_line, drug)
+        cells, t_pushdown = timed(query_pushdown, parquet_path, cell_line, drug)
+        assert {plate: sorted(c) for plate, c in cells.items()} == {
+            plate: sorted(c) for plate, c in cells_scan.items()
+        }
+
+        def read_backed():
+            for plate, idxs in cells_scan.items():
+                adata = ad.read_h5ad(directory / f"{plate}.h5ad", backed="r")
+                adata[idxs].to_memory()
+                adata.file.close()
+
+        def read_coalesced():
+            for plate, idxs in cells.items():
+                atlas.read_h5ad_rows(
+                    directory / f"{plate}.h5ad", idxs, max_gap=args.max_gap
+                )
+
+        _, t_backed = timed(read_backed)
+        _, t_coalesced = timed(read_coalesced)
+
+    n_cells = sum(len(c) for c in cells.values())
+    print(f"{n_cells} cells of {args.n_plates * args.n_cells_per_plate} selected")
+    print(f"parquet, full scan:       {t_scan:8.2f} s")
+    print(f"parquet, pushdown:        {t_pushdown:8.2f} s")
+    print(f"h5ad, backed AnnData:     {t_backed:8.2f} s")
+    print(f"h5ad, coalesced reads:    {t_coalesced:8.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Compare reading a bulk RNA-seq count matrix with and without typed parsing.
+
+Run with::
+
+    python benchmarks/bulk_counts.py --n-genes 60000 --n-samples 5000
+
+Each reader runs in a fresh process, which reports its peak memory. At the
+default size, the text file has ~2 GB and the untyped path needs tens of GB.
+"""
+
+import argparse
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import anndata as ad
+import numpy as np
+import pandas as pd
+from lamin_usecases import bulk
+
+
+def write_counts(path: Path, n_genes: int, n_samples: int, seed: int = 0) -> None:
+    """Write a salmon-like count matrix with `gene_id` and `gene_name` columns."""
+    rng = np.random.default_rng(seed)
+    header = ["gene_id", "gene_name"] + [f"SAMPLE_{j}" for j in range(n_samples)]
+    with open(path, "w") as f:
+        f.write("\t".join(header) + "\n")
+        for start in range(0, n_genes, 1000):
+            stop = min(start + 1000, n_genes)
+            counts = rng.negative_binomial(2, 0.01, (stop - start, n_samples))
+            df = pd.DataFrame(counts.astype(np.float32) + 0.5)
+            df.insert(0, "gene_name", [f"GENE{i}" for i in range(start, stop)])
+            df.insert(0, "gene_id", [f"ENSG{i:011d}" for i in range(start, stop)])
+            df.to_csv(f, sep="\t", header=False, index=False)
+
+
+def read_untyped(path: Path) -> ad.AnnData:
+    """The current path of the bulk RNA-seq use case."""
+    df = pd.read_csv(path, sep="\t", index_col=None).T
+    var = pd.DataFrame(
+        {"gene_name": df.loc["gene_name"].values}, index=df.loc["gene_id"]
+    )
+    return ad.AnnData(df.iloc[2:].astype("float32"), var=var)
+
+
+def read_typed(path: Path) -> ad.AnnData:
+    return bulk.read_counts(path)
+
+
+def run(reader, path: Path) -> tuple[float, float, tuple[int, int]]:
+    start = time.perf_counter()
+    adata = reader(path)
+    seconds = time.perf_counter() - start
+    peak_gb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**20  # KB on Linux
+    return seconds, peak_gb, adata.shape
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--n-genes", type=int, default=60_000)
+    parser.add_argument("--n-samples", type=int, default=5_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "salmon.merged.gene_counts.tsv"
+        write_counts(path, args.n_genes, args.n_samples)
+        size_gb = path.stat().st_size / 2**30
+        results = {}
+        for name, reader in [("untyped", read_untyped), ("typed", read_typed)]:
+            # a new process per reader, so that peak memory isn't shared
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                results[name] = executor.submit(run, reader, path).result()
+
+    print(f"{args.n_genes} genes x {args.n_samples} samples, {size_gb:.2f} GB of text")
+    for name, (seconds, peak_gb, shape) in results.items():
+        print(f"{name:8s} {seconds:8.2f} s  peak {peak_gb:6.2f} GB  shape {shape}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+"""Shared setup of the pytest-benchmark suite.
+
+Run with::
+
+    nox -s benchmarks
+
+or, to compare against the last saved run of this machine::
+
+    pytest benchmarks --benchmark-only --benchmark-autosave --benchmark-compare
+
+Every run with `--benchmark-autosave` is saved to `.benchmarks/<machine>/` in a
+file that's named after the commit. The comparison is a report; pass, e.g.,
+`--benchmark-compare-fail=median:25%` on a dedicated machine to fail on
+regressions. All data is synthetic and shaped like the
+datasets of the use cases, so that no instance or network access is needed.
+"""
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+# lamin_usecases and the model code of the spatial use case in docs/spatial_ml.py
+sys.path[:0] = [str(ROOT), str(ROOT / "docs")]
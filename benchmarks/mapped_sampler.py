@@ -0,0 +1,99 @@
+"""Compare `WeightedRandomSampler` and block sampling on a synthetic collection.
+
+Run with::
+
+    python benchmarks/mapped_sampler.py --n-files 8 --n-obs 50000
+
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import anndata as ad
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from lamin_usecases import mapped
+from lamindb.core import MappedCollection
+from torch.utils.data import DataLoader, WeightedRandomSampler
+
+
+def write_collection(
+    directory: Path, n_files: int, n_obs: int, n_vars: int, seed: int = 0
+) -> list[Path]:
+    """Write `.h5ad` files with sparse counts and imbalanced cell types."""
+    rng = np.random.default_rng(seed)
+    cell_types = ["T cell", "B cell", "monocyte", "NK cell", "dendritic cell"]
+    paths = []
+    for i in range(n_files):
+        X = sp.random(
+            n_obs,
+            n_vars,
+            density=0.05,
+            format="csr",
+            dtype=np.float32,
+            random_state=rng,
+        )
+        obs = pd.DataFrame(
+            {
+                "cell_type": pd.Categorical(
+                    rng.choice(cell_types, n_obs, p=[0.5, 0.25, 0.15, 0.08, 0.02])
+                )
+            },
+            index=[f"file{i}_cell{j}" for j in range(n_obs)],
+        )
+        var = pd.DataFrame(index=[f"gene{j}" for j in range(n_vars)])
+        path = directory / f"file{i}.h5ad"
+        ad.AnnData(X=X, obs=obs, var=var).write_h5ad(path)
+        paths.append(path)
+    return paths
+
+
+def rows_per_second(batches, max_batches: int) -> float:
+    n_rows = 0
+    start = time.perf_counter()
+    for i, batch in enumerate(batches):
+        n_rows += len(batch["X"])
+        if i + 1 == max_batches:
+            break
+    return n_rows / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--n-files", type=int, default=8)
+    parser.add_argument("--n-obs", type=int, default=50_000)
+    parser.add_argument("--n-vars", type=int, default=2_000)
+    parser.add_argument("--batch-size", type=int, default=128)
+    parser.add_argument("--block-size", type=int, default=256)
+    parser.add_argument("--max-batches", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_collection(Path(directory), args.n_files, args.n_obs, args.n_vars)
+        with MappedCollection(paths, obs_keys=["cell_type"]) as dataset:
+            weights = dataset.get_label_weights("cell_type")
+
+            sampler = WeightedRandomSampler(weights=weights, num_samples=len(dataset))
+            dataloader = DataLoader(
+                dataset, batch_size=args.batch_size, sampler=sampler
+            )
+            random_rows = rows_per_second(dataloader, args.max_batches)
+
+            block_sampler = mapped.BlockShuffleSampler(
+                dataset.n_obs_list, weights=weights, block_size=args.block_size
+            )
+            loader = mapped.BlockShuffleLoader(
+                dataset, block_sampler, batch_size=args.batch_size
+            )
+            block_rows = rows_per_second(loader, args.max_batches)
+
+    print(f"WeightedRandomSampler: {random_rows:10.0f} rows/s")
+    print(f"BlockShuffleLoader:    {block_rows:10.0f} rows/s")
+    print(f"speedup:               {block_rows / random_rows:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""Random-row reads from a `MappedCollection` and block-wise reads."""
+
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+
+from lamin_usecases import mapped
+from lamindb.core import MappedCollection
+from mapped_sampler import write_collection
+
+N_FILES, N_OBS, N_VARS = 4, 20_000, 2_000
+N_ROWS, BATCH_SIZE = 2_048, 128
+
+
+@pytest.fixture(scope="module")
+def collection(tmp_path_factory):
+    paths = write_collection(tmp_path_factory.mktemp("mapped"), N_FILES, N_OBS, N_VARS)
+    with MappedCollection(paths, obs_keys=["cell_type"]) as dataset:
+        yield dataset
+
+
+def test_random_rows(benchmark, collection):
+    rng = np.random.default_rng(0)
+
+    def read():
+        # what a DataLoader with a random sampler does per batch
+        indices = rng.integers(0, len(collection), N_ROWS)
+        return [collection[i]["X"] for i in indices]
+
+    assert len(benchmark(read)) == N_ROWS
+
+
+def test_block_shuffle_rows(benchmark, collection):
+    sampler = mapped.BlockShuffleSampler(
+        collection.n_obs_list, num_samples=N_ROWS, block_size=256, seed=0
+    )
+    loader = mapped.BlockShuffleLoader(collection, sampler, batch_size=BATCH_SIZE)
+
+    def read():
+        return sum(len(batch["X"]) for batch in loader)
+
+    assert benchmark(read) == N_ROWS
@@ -0,0 +1,54 @@
+"""Preprocessing of the Seurat ifnb dataset of `datasets.anndata_seurat_ifnb`."""
+
+import anndata as ad
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.sparse as sp
+from lamin_usecases import datasets
+
+# the shape of ifnb.h5ad
+N_OBS, N_VARS = 13_999, 14_053
+
+
+@pytest.fixture(scope="module")
+def ifnb():
+    """Counts and annotations like those of ifnb.h5ad after SeuratDisk's conversion."""
+    rng = np.random.default_rng(0)
+    X = sp.random(
+        N_OBS, N_VARS, density=0.06, format="csr", dtype=np.float32, random_state=rng
+    )
+    X.data = rng.integers(1, 20, X.nnz).astype(np.float32)
+    obs = pd.DataFrame(
+        {
+            "orig.ident": pd.Categorical(
+                rng.choice(["IMMUNE_CTRL", "IMMUNE_STIM"], N_OBS)
+            ),
+            "nCount_RNA": np.asarray(X.sum(axis=1)).ravel(),
+            "nFeature_RNA": np.diff(X.indptr),
+            "stim": rng.choice(["CTRL", "STIM"], N_OBS),
+            "seurat_annotations": rng.integers(0, 13, N_OBS),
+        },
+        index=[f"AAACATACATTTCC.{i}" for i in range(N_OBS)],
+    )
+    symbols = [f"GENE{j}" for j in range(N_VARS)]
+    var = pd.DataFrame({"features": symbols}, index=symbols)
+    adata = ad.AnnData(X=X, obs=obs, var=var)
+    adata.raw = adata
+    adata.raw.var["_index"] = symbols
+    return adata
+
+
+@pytest.mark.parametrize("preprocess", [False, True])
+def test_format_seurat_ifnb(benchmark, ifnb, preprocess):
+    pytest.importorskip("scanpy")
+
+    adata = benchmark.pedantic(
+        datasets.format_seurat_ifnb,
+        setup=lambda: ((ifnb.copy(),), {"preprocess": preprocess}),
+        rounds=5,
+        warmup_rounds=1,  # imports scanpy and compiles its numba kernels
+    )
+    assert adata.shape == (N_OBS, N_VARS)
+    assert adata.obs["stim"].is_monotonic_increasing
+    assert "symbol" in adata.raw.var
@@ -0,0 +1,74 @@
+"""Lookup, validation and standardization of gene symbols against an ontology.
+
+These are the functions behind `bt.Gene.public().lookup()`, `.validate()` and
+`.standardize()`, run on a synthetic table shaped like the Ensembl genes of
+bionty, so that the ontology isn't downloaded.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+try:  # private modules of lamindb, which may move
+    from lamindb.models.can_curate import standardize, validate
+    from lamindb.models.query_manager import Lookup
+except ImportError as e:
+    pytest.skip(f"lamindb moved its curation functions: {e}", allow_module_level=True)
+
+N_GENES, N_IDENTIFIERS = 60_000, 20_000
+
+
+@pytest.fixture(scope="module")
+def genes() -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    symbols = [f"GENE{i}" for i in range(N_GENES)]
+    synonyms = [
+        "|".join(f"ALIAS{i}-{j}" for j in range(n))
+        for i, n in enumerate(rng.integers(0, 4, N_GENES))
+    ]
+    return pd.DataFrame(
+        {
+            "ensembl_gene_id": [f"ENSG{i:011d}" for i in range(N_GENES)],
+            "symbol": symbols,
+            "synonyms": synonyms,
+            "biotype": rng.choice(["protein_coding", "lncRNA", "miRNA"], N_GENES),
+        }
+    )
+
+
+@pytest.fixture(scope="module")
+def identifiers(genes) -> list[str]:
+    """The var names of a dataset: symbols, lower-cased symbols, aliases, unknowns."""
+    rng = np.random.default_rng(1)
+    rows = genes.iloc[rng.choice(N_GENES, N_IDENTIFIERS, replace=False)]
+    kind = rng.choice(4, N_IDENTIFIERS, p=[0.85, 0.05, 0.05, 0.05])
+    identifiers = []
+    for k, (symbol, synonyms) in zip(
+        kind, rows[["symbol", "synonyms"]].itertuples(index=False), strict=True
+    ):
+        if k == 1:
+            symbol = symbol.lower()
+        elif k == 2 and synonyms:
+            symbol = synonyms.split("|")[0]
+        elif k == 3:
+            symbol = f"UNKNOWN-{symbol}"
+        identifiers.append(symbol)
+    return identifiers
+
+
+def test_lookup(benchmark, genes):
+    lookup = benchmark(
+        lambda: Lookup(df=genes, field="symbol", tuple_name="Gene").lookup()
+    )
+    assert lookup.dict()["GENE7"].ensembl_gene_id == "ENSG00000000007"
+
+
+def test_validate(benchmark, genes, identifiers):
+    validated = benchmark(validate, identifiers, genes["symbol"], mute=True)
+    assert 0.8 < validated.mean() < 0.9
+
+
+def test_standardize(benchmark, genes, identifiers):
+    standardized = benchmark(standardize, genes, identifiers, field="symbol", mute=True)
+    assert len(standardized) == N_IDENTIFIERS
+    assert np.mean([s.startswith("GENE") for s in standardized]) > 0.9
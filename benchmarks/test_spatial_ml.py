@@ -0,0 +1,107 @@
+"""Loading tiles and the forward pass of the model of the spatial use case.
+
+The tiles are shaped like those of `ImageTilesDataset` in `spatial4.md`: one
+`SpatialData` per cell with a rasterized 3 × 32 × 32 image and a one-row table.
+"""
+
+from typing import TYPE_CHECKING
+
+import anndata as ad
+import numpy as np
+import pandas as pd
+import pytest
+
+if TYPE_CHECKING:
+    import torch
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("spatialdata")
+pytest.importorskip("pytorch_lightning")
+pytest.importorskip("monai")
+
+from spatial_ml import DenseNetModel, TilesDataModule, tile_transform
+from spatialdata import SpatialData
+from spatialdata.models import Image2DModel, TableModel
+
+IMAGE_KEY = "CytAssist_FFPE_Human_Breast_Cancer_full_image"
+CELL_TYPES = [
+    "B-cells",
+    "CAFs",
+    "Cancer Epithelial",
+    "Endothelial",
+    "Myeloid",
+    "Normal Epithelial",
+    "PVL",
+    "Plasmablasts",
+    "T-cells",
+]
+N_TILES, TILE_SHAPE, BATCH_SIZE = 512, (3, 32, 32), 64
+
+
+class Tiles(torch.utils.data.Dataset):
+    """Applies `tile_transform` to every tile like `ImageTilesDataset`."""
+
+    def __init__(self, tiles: list[SpatialData]):
+        self.tiles = tiles
+
+    def __len__(self) -> int:
+        return len(self.tiles)
+
+    def __getitem__(self, i: int) -> tuple[torch.Tensor, torch.Tensor]:
+        return tile_transform(self.tiles[i])
+
+
+@pytest.fixture(scope="module")
+def tiles() -> list[SpatialData]:
+    rng = np.random.default_rng(0)
+    tiles = []
+    for i in range(N_TILES):
+        image = rng.integers(0, 256, TILE_SHAPE).astype(np.float32)
+        obs = pd.DataFrame(
+            {"celltype_major": pd.Categorical([rng.choice(CELL_TYPES)], CELL_TYPES)},
+            index=[f"cell{i}"],
+        )
+        tiles.append(
+            SpatialData(
+                images={IMAGE_KEY: Image2DModel.parse(image, dims=("c", "y", "x"))},
+                tables={"table": TableModel.parse(ad.AnnData(obs=obs))},
+            )
+        )
+    return tiles
+
+
+def test_tile_transform(benchmark, tiles):
+    def transform_all():
+        return [tile_transform(tile) for tile in tiles[:BATCH_SIZE]]
+
+    transformed = benchmark(transform_all)
+    assert transformed[0][0].shape == TILE_SHAPE
+
+
+def test_tiles_data_module(benchmark, tiles):
+    # no workers, so that the time of the transforms isn't hidden by processes
+    data_module = TilesDataModule(
+        batch_size=BATCH_SIZE, num_workers=0, dataset=Tiles(tiles)
+    )
+    data_module.setup()
+
+    def iterate():
+        return sum(len(labels) for _, labels in data_module.train_dataloader())
+
+    n_tiles = benchmark(iterate)
+    assert n_tiles == int(N_TILES * 0.7)
+
+
+def test_densenet_forward(benchmark):
+    torch.manual_seed(0)
+    model = DenseNetModel(
+        learning_rate=1e-5, in_channels=TILE_SHAPE[0], num_classes=len(CELL_TYPES)
+    ).eval()
+    batch = torch.rand(BATCH_SIZE, *TILE_SHAPE)
+
+    def forward():
+        with torch.no_grad():
+            return model(batch)
+
+    logits = benchmark(forward)
+    assert logits.shape == (BATCH_SIZE, len(CELL_TYPES))
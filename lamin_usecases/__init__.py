@@ -8,4 +8,13 @@ Import the package::
 
 __version__ = "0.0.1"  # denote a pre-release for 0.1.0 with 0.1rc1
 
+from . import _atlas as atlas
+from . import _bulk as bulk
+from . import _cache as cache
+from . import _cytometry as cytometry
 from . import _datasets as datasets
+from . import _h5mu as h5mu
+from . import _imaging as imaging
+from . import _mapped as mapped
+from . import _soma as soma
+from . import _stages as stages
@@ -0,0 +1,114 @@
+"""Query cell metadata in parquet and read the matching rows of `.h5ad` files."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, BinaryIO
+
+import numpy as np
+import pandas as pd
+
+from ._io import coalesce_rows, read_elem, read_row_ranges
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+    from pathlib import Path
+
+    import anndata as ad
+    import h5py
+    import pyarrow.compute as pc
+    import pyarrow.dataset as pds
+
+
+def query_parquet(
+    dataset: pds.Dataset,
+    filter: pc.Expression,
+    *,
+    by: str,
+    columns: Sequence[str],
+) -> dict[Any, pd.DataFrame]:
+    """Filter a parquet dataset and group the matching rows by a column.
+
+    The filter is pushed into the scan, so that row groups whose statistics
+    exclude a match are skipped, and only `by` and `columns` are read.
+
+    Args:
+        dataset: The parquet dataset, e.g., from `artifact.open()`.
+        filter: The filter expression, e.g.,
+            `(pc.field("cell_name") == "A549") & (pc.field("drug") == "Piroxicam")`.
+        by: The column to group by, typically the column that identifies the
+            source file of a row.
+        columns: The columns to return for each group.
+
+    Returns:
+        A dataframe with `columns` for every value of `by` that has matching rows.
+    """
+    table = dataset.to_table(columns=[by, *columns], filter=filter)
+    df = table.to_pandas()
+    return {key: group[list(columns)] for key, group in df.groupby(by, observed=True)}
+
+
+def read_h5ad_rows(
+    file: str | Path | BinaryIO | h5py.File,
+    obs_names: Sequence[str] | None = None,
+    *,
+    positions: Sequence[int] | np.ndarray | None = None,
+    max_gap: int = 256,
+) -> ad.AnnData:
+    """Read a subset of rows of an `.h5ad` file with sorted, coalesced reads.
+
+    The rows are sorted and merged into ranges with :func:`coalesce_rows` so that
+    each range is read with one contiguous request per array, which is what makes
+    the difference when streaming from cloud storage. Of `.obs`, only the index is
+    read; join the metadata from the parquet query instead.
+
+    Args:
+        file: A path, a file-like object, e.g., `artifact.path.open("rb")`, or an
+            open `h5py.File`.
+        obs_names: The names of the rows to read.
+        positions: The integer positions of the rows to read, instead of `obs_names`.
+        max_gap: See :func:`coalesce_rows`.
+
+    Returns:
+        An `AnnData` with the requested rows in the order in which they're stored.
+    """
+    import h5py
+
+    if (obs_names is None) == (positions is None):
+        raise ValueError("pass either obs_names or positions")
+    if isinstance(file, h5py.File):
+        return _read_h5ad_rows(file, obs_names, positions, max_gap)
+    with h5py.File(file, mode="r") as f:
+        return _read_h5ad_rows(f, obs_names, positions, max_gap)
+
+
+def _read_index(group: h5py.Group) -> pd.Index:
+    return pd.Index(read_elem(group[group.attrs["_index"]]))
+
+
+def _read_h5ad_rows(
+    f: h5py.File,
+    obs_names: Sequence[str] | None,
+    positions: Sequence[int] | np.ndarray | None,
+    max_gap: int,
+) -> ad.AnnData:
+    import anndata as ad
+
+    obs_index = _read_index(f["obs"])
+    if obs_names is not None:
+        positions = obs_index.get_indexer(obs_names)
+        if (positions == -1).any():
+            missing = list(pd.Index(obs_names)[positions == -1][:5])
+            raise KeyError(f"obs_names not in file, e.g., {missing}")
+    positions = np.unique(np.asarray(positions, dtype=np.int64))
+    ranges = coalesce_rows(positions, max_gap)
+    var = pd.DataFrame(index=_read_index(f["var"]))
+
+    if not ranges:
+        return ad.AnnData(obs=pd.DataFrame(index=obs_index[:0]), var=var)
+    values = read_row_ranges(f["X"], ranges)
+    # the ranges may contain rows in the gaps that weren't requested
+    covered = np.concatenate([np.arange(start, stop) for start, stop in ranges])
+    keep = np.searchsorted(covered, positions)
+    return ad.AnnData(
+        X=values[keep], obs=pd.DataFrame(index=obs_index[positions]), var=var
+    )
@@ -0,0 +1,160 @@
+"""Parse bulk RNA-seq count matrices into typed arrays."""
+
+from __future__ import annotations
+
+import gzip
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator, Sequence
+    from pathlib import Path
+
+    import anndata as ad
+
+
+def _open_binary(path: str | Path):
+    return gzip.open(path) if str(path).endswith(".gz") else open(path, "rb")
+
+
+def _header(path: str | Path, sep: str) -> list[str]:
+    with _open_binary(path) as f:
+        return f.readline().decode().rstrip("\r\n").split(sep)
+
+
+def _count_rows(path: str | Path) -> int:
+    n_newlines, last = 0, b"\n"
+    with _open_binary(path) as f:
+        while block := f.read(2**24):
+            n_newlines += block.count(b"\n")
+            last = block[-1:]
+    # the header is a row, the last row may lack a newline
+    return n_newlines - 1 + (last != b"\n")
+
+
+def iter_counts(
+    path: str | Path,
+    *,
+    metadata_columns: Sequence[str] = ("gene_id", "gene_name"),
+    samples: Sequence[str] | None = None,
+    sep: str = "\t",
+    chunk_size: int = 10_000,
+) -> Iterator[tuple[pd.DataFrame, np.ndarray]]:
+    """Iterate over a count matrix with one row per gene in chunks of rows.
+
+    The metadata columns are parsed as strings and the sample columns directly
+    as `float32`, so that no string-typed copy of the counts is ever created.
+
+    Args:
+        path: A delimited text file, e.g., the `salmon.merged.gene_counts.tsv` of
+            nf-core/rnaseq, optionally gzip-compressed.
+        metadata_columns: The columns that describe the genes.
+        samples: The sample columns to read; all other columns if `None`.
+            Reading subsets bounds memory for very wide matrices.
+        sep: The delimiter.
+        chunk_size: The number of genes per chunk.
+
+    Yields:
+        The metadata of the genes of a chunk and their counts as a
+        genes × samples `float32` array.
+    """
+    columns = _header(path, sep)
+    missing = [column for column in metadata_columns if column not in columns]
+    if missing:
+        raise ValueError(f"metadata columns {missing} not in {path}")
+    if samples is None:
+        samples = [column for column in columns if column not in metadata_columns]
+    dtype = dict.fromkeys(metadata_columns, str)
+    dtype.update(dict.fromkeys(samples, np.float32))
+    reader = pd.read_csv(
+        path,
+        sep=sep,
+        usecols=[*metadata_columns, *samples],
+        dtype=dtype,
+        chunksize=chunk_size,
+        engine="c",
+    )
+    with reader:
+        for chunk in reader:
+            yield (
+                chunk[list(metadata_columns)],
+                chunk[list(samples)].to_numpy(dtype=np.float32, copy=False),
+            )
+
+
+def read_count_matrix(
+    path: str | Path,
+    *,
+    metadata_columns: Sequence[str] = ("gene_id", "gene_name"),
+    samples: Sequence[str] | None = None,
+    sep: str = "\t",
+    chunk_size: int = 10_000,
+) -> tuple[np.ndarray, pd.DataFrame, pd.Index]:
+    """Read a count matrix into one preallocated genes × samples `float32` array.
+
+    The rows are counted first so that the array is allocated once, in Fortran
+    order, and filled chunk by chunk with :func:`iter_counts`. Its transpose, the
+    samples × genes layout of `AnnData`, is C-contiguous and doesn't need a copy.
+
+    Returns:
+        The counts, the metadata of the genes and the names of the samples.
+    """
+    if samples is None:
+        columns = _header(path, sep)
+        samples = [column for column in columns if column not in metadata_columns]
+    n_genes = _count_rows(path)
+    counts = np.empty((n_genes, len(samples)), dtype=np.float32, order="F")
+    metadata = []
+    start = 0
+    for genes, values in iter_counts(
+        path,
+        metadata_columns=metadata_columns,
+        samples=samples,
+        sep=sep,
+        chunk_size=chunk_size,
+    ):
+        stop = start + len(values)
+        if stop > n_genes:
+            raise ValueError(f"{path} has more rows than lines")
+        counts[start:stop] = values
+        metadata.append(genes)
+        start = stop
+    # blank lines are counted but skipped by the parser
+    counts = counts[:start]
+    var = pd.concat(metadata, ignore_index=True) if metadata else pd.DataFrame()
+    return counts, var, pd.Index(samples)
+
+
+def read_counts(
+    path: str | Path,
+    *,
+    index: str = "gene_id",
+    metadata_columns: Sequence[str] = ("gene_id", "gene_name"),
+    samples: Sequence[str] | None = None,
+    sep: str = "\t",
+    chunk_size: int = 10_000,
+) -> ad.AnnData:
+    """Read a count matrix with one row per gene into a samples × genes `AnnData`.
+
+    Args:
+        path: See :func:`iter_counts`.
+        index: The metadata column that becomes the index of `.var`.
+        metadata_columns: The columns that describe the genes; they become `.var`.
+        samples: See :func:`iter_counts`.
+        sep: The delimiter.
+        chunk_size: The number of genes parsed at once.
+    """
+    import anndata as ad
+
+    counts, var, samples = read_count_matrix(
+        path,
+        metadata_columns=metadata_columns,
+        samples=samples,
+        sep=sep,
+        chunk_size=chunk_size,
+    )
+    var = var.set_index(index)
+    var.index.name = None
+    return ad.AnnData(X=counts.T, obs=pd.DataFrame(index=samples), var=var)
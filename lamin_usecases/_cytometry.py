@@ -0,0 +1,354 @@
+"""Stream the events of many `.fcs` files into one chunked, appendable store."""
+
+from __future__ import annotations
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+import numpy as np
+import pandas as pd
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator, Mapping, Sequence
+
+    import anndata as ad
+
+_DTYPES = {"F": "f4", "D": "f8"}
+_BYTE_ORDERS = {"1,2,3,4": "<", "1,2": "<", "4,3,2,1": ">", "2,1": ">"}
+
+
+def _parse_text(segment: bytes) -> dict[str, str]:
+    text = segment.decode("utf-8", errors="replace")
+    delimiter = text[0]
+    # a doubled delimiter is an escaped delimiter, FCS forbids empty values
+    parts = text[1:].replace(delimiter * 2, "\0").split(delimiter)
+    parts = [part.replace("\0", delimiter) for part in parts]
+    return {
+        key.strip().upper(): value.strip()
+        for key, value in zip(parts[0::2], parts[1::2], strict=False)
+    }
+
+
+class FcsHeader:
+    """The HEADER and TEXT segments of an `.fcs` file, without the events.
+
+    Args:
+        path: The path of the `.fcs` file.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            header = f.read(58)
+            if not header.startswith(b"FCS"):
+                raise ValueError(f"{self.path} isn't an FCS file")
+            text_start, text_stop = int(header[10:18]), int(header[18:26])
+            f.seek(text_start)
+            self.text = _parse_text(f.read(text_stop - text_start + 1))
+        data_start, data_stop = int(header[26:34]), int(header[34:42])
+        if data_start == 0:  # files > 100 MB store the offsets in TEXT
+            data_start = int(self.text["$BEGINDATA"])
+            data_stop = int(self.text["$ENDDATA"])
+        self.data_offset = data_start
+        self.n_events = int(self.text["$TOT"])
+        self.n_channels = int(self.text["$PAR"])
+        self.channels = [self.text[f"$P{i}N"] for i in range(1, self.n_channels + 1)]
+        # like readfcs, name a channel by its marker if it has one
+        self.names = [
+            self.text.get(f"$P{i}S", "") or self.text[f"$P{i}N"]
+            for i in range(1, self.n_channels + 1)
+        ]
+        self.dtype = self._dtype()
+        self.mask = self._mask()
+        expected = self.n_events * self.n_channels * self.dtype.itemsize
+        if data_stop - data_start + 1 < expected:
+            raise ValueError(f"{self.path} is truncated")
+
+    def _dtype(self) -> np.dtype:
+        if self.text.get("$MODE", "L") != "L":
+            raise ValueError(f"{self.path}: only list mode is supported")
+        byte_order = _BYTE_ORDERS.get(self.text.get("$BYTEORD", "1,2,3,4"))
+        if byte_order is None:
+            raise ValueError(f"{self.path}: unsupported $BYTEORD")
+        datatype = self.text["$DATATYPE"].upper()
+        if datatype == "I":
+            bits = {self.text[f"$P{i}B"] for i in range(1, self.n_channels + 1)}
+            if len(bits) != 1 or int(bits.pop()) not in (8, 16, 32, 64):
+                raise ValueError(f"{self.path}: unsupported integer widths")
+            width = int(self.text["$P1B"]) // 8
+            return np.dtype(f"{byte_order}u{width}")
+        if datatype not in _DTYPES:
+            raise ValueError(f"{self.path}: unsupported $DATATYPE {datatype}")
+        return np.dtype(byte_order + _DTYPES[datatype])
+
+    def _mask(self) -> np.ndarray | None:
+        """The bit mask of every channel of integer data, from its `$PnR`.
+
+        Like readfcs and fcsparser, the bits above the next power of two of the
+        range are ignored, as cytometers may store flags in them.
+        """
+        if self.dtype.kind != "u":
+            return None
+        ranges = [
+            int(float(self.text[f"$P{i}R"])) for i in range(1, self.n_channels + 1)
+        ]
+        max_value = np.iinfo(self.dtype).max
+        masks = [min(2 ** max(r - 1, 0).bit_length() - 1, max_value) for r in ranges]
+        if all(mask == max_value for mask in masks):
+            return None
+        return np.array(masks, dtype=self.dtype.newbyteorder("="))
+
+    def iter_events(self, chunk_size: int) -> Iterator[np.ndarray]:
+        """Memory-map the DATA segment and yield chunks of events as `float32`.
+
+        Integer events are masked by the range of their channel.
+        """
+        events = np.memmap(
+            self.path,
+            dtype=self.dtype,
+            mode="r",
+            offset=self.data_offset,
+            shape=(self.n_events, self.n_channels),
+        )
+        for start in range(0, self.n_events, chunk_size):
+            chunk = events[start : start + chunk_size]
+            if self.mask is not None:
+                chunk = chunk & self.mask
+            yield np.asarray(chunk, dtype=np.float32)
+
+
+def read_panels(
+    paths: Mapping[str, str | Path], max_workers: int = 8
+) -> dict[str, list[str]]:
+    """Read the channel names of many `.fcs` files from their TEXT segments.
+
+    Returns:
+        The channel names of every file, named by marker where available.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        headers = executor.map(FcsHeader, paths.values())
+        return {key: header.names for key, header in zip(paths, headers, strict=True)}
+
+
+def validate_panels(
+    panels: Mapping[str, Sequence[str]], registry: Any
+) -> tuple[dict[str, str], list[str], list[str]]:
+    """Standardize and validate the union of the panels of many files at once.
+
+    Args:
+        panels: The channel names of every file, e.g., from :func:`read_panels`.
+        registry: The registry to validate against, e.g., `bt.CellMarker`.
+
+    Returns:
+        A mapping from channel names to their standardized names, the validated
+        markers and the remaining channels, which are typically metadata like
+        `Time`.
+    """
+    names = sorted(set(chain.from_iterable(panels.values())))
+    mapper = registry.standardize(names, return_mapper=True)
+    standardized = [mapper.get(name, name) for name in names]
+    validated = np.asarray(registry.validate(standardized, mute=True))
+    markers = sorted(
+        {name for name, v in zip(standardized, validated, strict=True) if v}
+    )
+    others = sorted(
+        {name for name, v in zip(standardized, validated, strict=True) if not v}
+    )
+    return dict(mapper), markers, others
+
+
+class FcsStore:
+    """A zarr store that collects the events of many `.fcs` files.
+
+    Events are appended to two chunked arrays: `X` with the markers and `obs`
+    with the remaining channels. Every file is recorded in the attribute `files`
+    with the rows it occupies, its size and a few FCS keywords, so that the
+    events of a file can be traced back to it.
+
+    Files are parsed in a thread pool, each chunk by chunk from a memory map of
+    its DATA segment, so that memory doesn't grow with the size of the files.
+    The rows of a file are reserved before its events are written; if ingestion
+    is interrupted, appending the same files again skips the completed ones and
+    rewrites the incomplete ones in place. Markers that aren't yet in the store
+    are added as new columns, which are `NaN` for earlier files.
+
+    Args:
+        path: The path of the store; it is created if it doesn't exist.
+        chunk_size: The number of events per chunk.
+    """
+
+    def __init__(self, path: str | Path, chunk_size: int = 65_536):
+        import zarr
+
+        self.path = Path(path)
+        self.chunk_size = chunk_size
+        self.group = zarr.open_group(str(self.path), mode="a")
+        self._lock = threading.Lock()
+
+    @property
+    def files(self) -> list[dict[str, Any]]:
+        """The provenance of the ingested files."""
+        return list(self.group.attrs.get("files", []))
+
+    @property
+    def var_names(self) -> list[str]:
+        """The markers, the columns of `X`."""
+        return list(self.group.attrs.get("var_names", []))
+
+    @property
+    def obs_columns(self) -> list[str]:
+        """The remaining channels, the columns of `obs`."""
+        return list(self.group.attrs.get("obs_columns", []))
+
+    @property
+    def n_events(self) -> int:
+        return max((file["stop"] for file in self.files), default=0)
+
+    def _array(self, name: str, n_columns: int) -> Any:
+        if name not in self.group:
+            create = getattr(self.group, "create_array", None)  # zarr >= 3
+            if create is None:
+                create = self.group.create_dataset
+            create(
+                name,
+                shape=(0, n_columns),
+                chunks=(self.chunk_size, max(n_columns, 1)),
+                dtype="float32",
+                fill_value=np.nan,
+            )
+        return self.group[name]
+
+    def _extend(self, name: str, new: Sequence[str], n_rows: int) -> list[str]:
+        columns = list(self.group.attrs.get(name, []))
+        columns += [column for column in new if column not in columns]
+        self.group.attrs[name] = columns
+        array = self._array("X" if name == "var_names" else "obs", len(columns))
+        # new columns of earlier rows are filled with NaN
+        array.resize((n_rows, len(columns)))
+        return columns
+
+    def append(
+        self,
+        paths: Mapping[str, str | Path],
+        *,
+        rename: Mapping[str, str] | None = None,
+        markers: Sequence[str],
+        cofactor: float | None = None,
+        max_workers: int = 4,
+    ) -> list[str]:
+        """Append the events of `.fcs` files.
+
+        Args:
+            paths: The paths of the files, keyed by an identifier that is stored
+                as their provenance, e.g., the uid of the artifact.
+            rename: Maps channel names to standardized names, e.g., from
+                :func:`validate_panels`.
+            markers: The channels that are stored in `X`.
+            cofactor: If given, markers are normalized with `arcsinh(x / cofactor)`,
+                like `pytometry.tl.normalize_arcsinh`.
+            max_workers: The number of files that are parsed concurrently.
+
+        Returns:
+            The identifiers of the appended files; completed files are skipped.
+        """
+        rename = dict(rename or {})
+        done = {file["id"] for file in self.files if file["complete"]}
+        keys = [key for key in paths if key not in done]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            parsed = executor.map(FcsHeader, [paths[key] for key in keys])
+            headers = dict(zip(keys, parsed, strict=True))
+
+        # reserve the rows of all files, reusing those of incomplete files
+        files = {file["id"]: file for file in self.files}
+        n_rows = self.n_events
+        for key, header in headers.items():
+            if key in files and files[key]["n_events"] == header.n_events:
+                continue
+            files[key] = {
+                "id": key,
+                "path": str(header.path),
+                "size": header.path.stat().st_size,
+                "n_events": header.n_events,
+                "start": n_rows,
+                "stop": n_rows + header.n_events,
+                "cytometer": header.text.get("$CYT"),
+                "date": header.text.get("$DATE"),
+                "complete": False,
+            }
+            n_rows += header.n_events
+        names = {key: [rename.get(n, n) for n in h.names] for key, h in headers.items()}
+        all_names = list(dict.fromkeys(chain.from_iterable(names.values())))
+        var_names = self._extend(
+            "var_names", [n for n in markers if n in all_names], n_rows
+        )
+        obs_columns = self._extend(
+            "obs_columns", [n for n in all_names if n not in markers], n_rows
+        )
+        self.group.attrs["files"] = list(files.values())
+
+        def ingest(key: str) -> str:
+            header, file = headers[key], files[key]
+            if len(set(names[key])) != len(names[key]):
+                raise ValueError(f"{key} has duplicate channels after renaming")
+            # where the channels of this file go in X and obs
+            x_source = [i for i, n in enumerate(names[key]) if n in markers]
+            x_target = [var_names.index(names[key][i]) for i in x_source]
+            obs_source = [i for i, n in enumerate(names[key]) if n not in markers]
+            obs_target = [obs_columns.index(names[key][i]) for i in obs_source]
+            X, obs = self.group["X"], self.group["obs"]
+            start = file["start"]
+            for events in header.iter_events(self.chunk_size):
+                x_block = np.full((len(events), len(var_names)), np.nan, np.float32)
+                x_block[:, x_target] = events[:, x_source]
+                if cofactor is not None:
+                    np.arcsinh(x_block / cofactor, out=x_block)
+                obs_block = np.full((len(events), len(obs_columns)), np.nan, np.float32)
+                obs_block[:, obs_target] = events[:, obs_source]
+                stop = start + len(events)
+                # neighboring files can share a chunk, which must not be written
+                # concurrently
+                with self._lock:
+                    X[start:stop] = x_block
+                    obs[start:stop] = obs_block
+                start = stop
+            with self._lock:
+                file["complete"] = True
+                self.group.attrs["files"] = list(files.values())
+            return key
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(ingest, headers))
+
+    def to_anndata(self, ids: Sequence[str] | None = None) -> ad.AnnData:
+        """Load the events of some or all complete files.
+
+        `.obs["file"]` holds the identifier of the file of every event.
+        """
+        import anndata as ad
+
+        files = [file for file in self.files if file["complete"]]
+        if ids is not None:
+            files = [file for file in files if file["id"] in set(ids)]
+        X, obs = self.group["X"], self.group["obs"]
+        ranges = [(file["start"], file["stop"]) for file in files]
+        obs_df = pd.DataFrame(
+            np.concatenate([obs[a:b] for a, b in ranges])
+            if ranges
+            else np.empty((0, len(self.obs_columns)), np.float32),
+            columns=self.obs_columns,
+        )
+        obs_df["file"] = pd.Categorical(
+            np.repeat([file["id"] for file in files], [b - a for a, b in ranges]),
+            categories=[file["id"] for file in files],
+        )
+        obs_df.index = obs_df.index.astype(str)
+        return ad.AnnData(
+            X=np.concatenate([X[a:b] for a, b in ranges])
+            if ranges
+            else np.empty((0, len(self.var_names)), np.float32),
+            obs=obs_df,
+            var=pd.DataFrame(index=self.var_names),
+        )
@@ -7,35 +7,15 @@ DATASETDIR = Path(__file__).parent.resolve() / "data/"
 DATASETDIR.mkdir(exist_ok=True)
 
 
-def anndata_seurat_ifnb(
-    preprocess: bool = True, populate_registries: bool = False
-) -> ad.AnnData:
-    """Seurat ifnb dataset.
-
-    PBMCs were split into a stimulated and control group and the stimulated group was treated with interferon beta.
-
-    To reproduce the format conversion in R:
-    >>> library(Seurat)
-    >>> library(SeuratDisk)
-    >>> library(SeuratData)
+def format_seurat_ifnb(adata: ad.AnnData, preprocess: bool = True) -> ad.AnnData:
+    """Annotate and sort the Seurat ifnb dataset after its conversion to `.h5ad`.
 
-    >>> ifnb = SeuratData::LoadData("ifnb")
-    >>> ifnb_updated = UpdateSeuratObject(ifnb)
-    >>> SaveH5Seurat(ifnb_updated, "ifnb.h5seurat", overwrite = T)
-    >>> Convert("ifnb.h5seurat", "ifnb.h5ad", overwrite = T)
+    Renames the cluster labels and the columns of `.obs` and `.var` in place and
+    returns a copy that is sorted by condition and, if `preprocess`, normalized
+    and log-transformed.
     """
-    import anndata as ad
     import pandas as pd
-    from bionty.base.dev._io import s3_bionty_assets
-
-    filepath = DATASETDIR / "ifnb.h5ad"
-    s3_bionty_assets(
-        filename="ifnb.h5ad",
-        localpath=filepath,
-        assets_base_url="s3://lamindb-test",
-    )
 
-    adata = ad.read_h5ad(filepath)
     # from https://satijalab.org/seurat/archive/v3.2/immune_alignment.html
     anno_mapper = {
         "0": "CD14 Mono",
@@ -72,6 +52,37 @@ def anndata_seurat_ifnb(
 
         sc.pp.normalize_total(adata)
         sc.pp.log1p(adata)
+    return adata
+
+
+def anndata_seurat_ifnb(
+    preprocess: bool = True, populate_registries: bool = False
+) -> ad.AnnData:
+    """Seurat ifnb dataset.
+
+    PBMCs were split into a stimulated and control group and the stimulated group was treated with interferon beta.
+
+    To reproduce the format conversion in R:
+    >>> library(Seurat)
+    >>> library(SeuratDisk)
+    >>> library(SeuratData)
+
+    >>> ifnb = SeuratData::LoadData("ifnb")
+    >>> ifnb_updated = UpdateSeuratObject(ifnb)
+    >>> SaveH5Seurat(ifnb_updated, "ifnb.h5seurat", overwrite = T)
+    >>> Convert("ifnb.h5seurat", "ifnb.h5ad", overwrite = T)
+    """
+    import anndata as ad
+    from bionty.base.dev._io import s3_bionty_assets
+
+    filepath = DATASETDIR / "ifnb.h5ad"
+    s3_bionty_assets(
+        filename="ifnb.h5ad",
+        localpath=filepath,
+        assets_base_url="s3://lamindb-test",
+    )
+
+    adata = format_seurat_ifnb(ad.read_h5ad(filepath), preprocess=preprocess)
 
     if populate_registries:
         import bionty as bt
@@ -0,0 +1,236 @@
+"""Access the modalities of an `.h5mu` file lazily."""
+
+from __future__ import annotations
+
+from collections.abc import Mapping
+from functools import cached_property
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, BinaryIO
+
+from ._io import read_elem, write_elem
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Iterator
+
+    import anndata as ad
+    import h5py
+    import pandas as pd
+    from mudata import MuData
+
+# the slots of the MuData object that are small enough to always be read with it
+_GLOBAL_SLOTS = ("obsm", "obsmap", "varmap")
+
+
+def _read(group: h5py.Group, key: str, default: Any = None) -> Any:
+    return read_elem(group[key]) if key in group else default
+
+
+class LazyModality:
+    """A modality of an `.h5mu` file whose slots are read on first access.
+
+    Once read, a slot is kept; delete it, e.g., `del modality.X`, to free it.
+    """
+
+    def __init__(self, group: h5py.Group):
+        self.group = group
+        self.name = group.name.rsplit("/", 1)[-1]
+
+    @cached_property
+    def obs(self) -> pd.DataFrame:
+        return _read(self.group, "obs")
+
+    @cached_property
+    def var(self) -> pd.DataFrame:
+        return _read(self.group, "var")
+
+    @cached_property
+    def X(self) -> Any:
+        return _read(self.group, "X")
+
+    def read(self, slot: str) -> Any:
+        """Read any other slot, e.g., `"layers"` or `"obsm"`."""
+        return _read(self.group, slot, {})
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        if "X" in self.group:
+            X = self.group["X"]
+            shape = X.attrs["shape"] if "shape" in X.attrs else X.shape
+            return int(shape[0]), int(shape[1])
+        return len(self.obs), len(self.var)
+
+    def to_anndata(self, X: bool = True) -> ad.AnnData:
+        """Build an `AnnData` with `.obs` and `.var`, and `.X` if `X` is `True`."""
+        import anndata as ad
+
+        return ad.AnnData(X=self.X if X else None, obs=self.obs, var=self.var)
+
+    def __repr__(self) -> str:
+        n_obs, n_vars = self.shape
+        return f"LazyModality {self.name!r} with n_obs × n_vars = {n_obs} × {n_vars}"
+
+
+class LazyMuData(Mapping):
+    """Open an `.h5mu` file once and read its modalities on demand.
+
+    Opening the file reads nothing but the names of the modalities. A modality's
+    `.obs`, `.var` and `.X` are read when they're accessed, so that, e.g., the
+    annotations of all modalities can be curated without reading any matrix::
+
+        papalexi = LazyMuData(artifact.cache())
+        papalexi["rna"].obs
+        mdata = papalexi.to_mudata(X=False)
+
+    Args:
+        file: A path, a file-like object or an open `h5py.File`.
+    """
+
+    def __init__(self, file: str | Path | BinaryIO | h5py.File):
+        import h5py
+
+        self._owns_file = not isinstance(file, h5py.File)
+        self.file: h5py.File = (
+            file if isinstance(file, h5py.File) else h5py.File(file, mode="r")
+        )
+        mods = self.file["mod"]
+        names = list(mods)
+        if "mod-order" in mods.attrs:
+            order = [str(name) for name in mods.attrs["mod-order"]]
+            if set(order) == set(names):
+                names = order
+        self.mod = {name: LazyModality(mods[name]) for name in names}
+
+    @cached_property
+    def obs(self) -> pd.DataFrame:
+        return _read(self.file, "obs")
+
+    @cached_property
+    def var(self) -> pd.DataFrame:
+        return _read(self.file, "var")
+
+    @cached_property
+    def uns(self) -> dict[str, Any]:
+        return _read(self.file, "uns", {})
+
+    @property
+    def n_obs(self) -> int:
+        return len(self.obs)
+
+    def __getitem__(self, name: str) -> LazyModality:
+        return self.mod[name]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.mod)
+
+    def __len__(self) -> int:
+        return len(self.mod)
+
+    def to_mudata(self, X: bool | Iterable[str] = False) -> MuData:
+        """Build a `MuData` with the annotations of all modalities.
+
+        Args:
+            X: The modalities whose `.X` is read, all if `True`. The `.X` of the
+                others is `None`, hence a `MuData` with `X=False` holds only the
+                annotations and can be curated, but not be saved as is; use
+                :func:`write_annotations` instead.
+        """
+        from mudata import MuData
+
+        with_X = set(self.mod) if X is True else set(X or ())
+        if unknown := with_X - set(self.mod):
+            raise KeyError(f"no modalities {sorted(unknown)} in {self.file.filename}")
+        mods = {
+            name: modality.to_anndata(X=name in with_X)
+            for name, modality in self.mod.items()
+        }
+        kwargs = {slot: _read(self.file, slot, {}) for slot in _GLOBAL_SLOTS}
+        return MuData(
+            mods,
+            obs=self.obs,
+            var=self.var,
+            uns=self.uns,
+            axis=int(self.file.attrs.get("axis", 0)),
+            **kwargs,
+        )
+
+    def close(self) -> None:
+        if self._owns_file:
+            self.file.close()
+
+    def __enter__(self) -> LazyMuData:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __repr__(self) -> str:
+        mods = ", ".join(f"{name!r}" for name in self.mod)
+        return f"LazyMuData of {self.file.filename} with modalities {mods}"
+
+
+def write_annotations(mdata: MuData, source: str | Path, target: str | Path) -> Path:
+    """Write the annotations of a `MuData` into a copy of an `.h5mu` file.
+
+    All elements of `source` but the `.obs`, `.var` and `.uns` of the `MuData`
+    and the `.obs` and `.var` of its modalities are copied as they are stored,
+    like `h5repack` does, so that annotations curated on
+    `LazyMuData.to_mudata(X=False)` are saved without reading any matrix. As
+    the file is written anew rather than changed in place, it doesn't keep the
+    space of the replaced annotations.
+
+    Args:
+        mdata: The curated annotations; the modalities and their shapes must be
+            those of `source`.
+        source: The `.h5mu` file that holds the matrices.
+        target: The path of the new `.h5mu` file.
+
+    Returns:
+        The path of the new file.
+    """
+    import h5py
+
+    target = Path(target)
+    mdata.update()  # the global names follow those of the modalities
+    tmp_path = target.with_suffix(".tmp")
+    try:
+        with h5py.File(source, mode="r") as src:
+            if set(mdata.mod) != set(src["mod"]):
+                raise ValueError(
+                    f"modalities {sorted(mdata.mod)} differ from {sorted(src['mod'])}"
+                )
+            for name, adata in mdata.mod.items():
+                shape = LazyModality(src["mod"][name]).shape
+                if adata.shape != shape:
+                    raise ValueError(
+                        f"{name} has shape {adata.shape}, but {shape} in {source}"
+                    )
+            userblock_size = src.userblock_size
+            with h5py.File(tmp_path, mode="w", userblock_size=userblock_size) as dst:
+                _copy_except(src, dst, ("obs", "var", "uns", "mod"))
+                mod = dst.create_group("mod")
+                mod.attrs.update(src["mod"].attrs)
+                for name, adata in mdata.mod.items():
+                    group = mod.create_group(name)
+                    _copy_except(src["mod"][name], group, ("obs", "var"))
+                    for slot in ("obs", "var"):
+                        write_elem(group, slot, getattr(adata, slot))
+                for slot in ("obs", "var", "uns"):
+                    value = getattr(mdata, slot)
+                    write_elem(dst, slot, dict(value) if slot == "uns" else value)
+        if userblock_size:  # MuData marks its files in the user block
+            with open(source, "rb") as f:
+                userblock = f.read(userblock_size)
+            with open(tmp_path, "r+b") as f:
+                f.write(userblock)
+        tmp_path.replace(target)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return target
+
+
+def _copy_except(src: h5py.Group, dst: h5py.Group, skip: Iterable[str]) -> None:
+    """Copy the attributes and the members of a group, except those in `skip`."""
+    dst.attrs.update(src.attrs)
+    for name in src:
+        if name not in skip:
+            src.copy(src[name], dst, name=name)
@@ -0,0 +1,342 @@
+"""Process fields of view with scPortrait and read selected single-cell images."""
+
+from __future__ import annotations
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, BinaryIO
+
+import numpy as np
+import pandas as pd
+
+from ._io import coalesce_rows, read_elem
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterator, Mapping, Sequence
+
+    import anndata as ad
+    import h5py
+
+IMAGES_KEY = "single_cell_images"
+CELL_ID_KEY = "scportrait_cell_id"
+
+
+class _H5scSelection:
+    """The positions of the selected cells in one `.h5sc` file."""
+
+    def __init__(self, f: h5py.File, cell_ids: np.ndarray, rows: np.ndarray):
+        self.f = f
+        self.images = f["obsm"][IMAGES_KEY]
+        # of .obs, only read the cell ids
+        file_ids = pd.Index(read_elem(f["obs"][CELL_ID_KEY]))
+        positions = file_ids.get_indexer(cell_ids)
+        if (positions == -1).any():
+            missing = list(cell_ids[positions == -1][:5])
+            raise KeyError(f"{CELL_ID_KEY} not in {f.filename}, e.g., {missing}")
+        # sort by position so that the file is read front to back
+        order = np.argsort(positions, kind="stable")
+        self.positions = positions[order]
+        self.rows = rows[order]
+
+    def read_into(self, out: np.ndarray, max_gap: int) -> None:
+        """Write the images of the selected cells into their rows of `out`."""
+        unique = np.unique(self.positions)
+        for start, stop in coalesce_rows(unique, max_gap):
+            # the positions are sorted, so the cells of a range are a slice of them
+            lo, hi = np.searchsorted(self.positions, [start, stop])
+            block = self.images[start:stop]
+            out[self.rows[lo:hi]] = block[self.positions[lo:hi] - start]
+
+
+def read_h5sc_cells(
+    cells: pd.DataFrame,
+    open_file: Callable[[Any], str | Path | BinaryIO],
+    *,
+    by: str = "dataset",
+    max_gap: int = 4,
+    max_workers: int = 8,
+) -> ad.AnnData:
+    """Read the images of selected cells from several scPortrait `.h5sc` files.
+
+    Per file, only the `scportrait_cell_id` column of `.obs` is read to locate the
+    selected cells; their images are then read in sorted order, merging cells
+    that are at most `max_gap` rows apart into one read. The output array is
+    allocated once and filled in place, so that memory is proportional to the
+    number of selected cells rather than to the size of the files.
+
+    The files are opened and read in a thread pool, which overlaps fetching
+    them, e.g., through `artifact.cache()`. `h5py` serializes calls into HDF5, so
+    reads from local files don't run concurrently.
+
+    Args:
+        cells: One row per cell to read with a `scportrait_cell_id` column and
+            the column `by` that identifies the file of a cell.
+        open_file: Returns a path or a file-like object for a value of `by`, e.g.,
+            `lambda uid: ln.Artifact.get(uid).cache()`.
+        by: The column that identifies the file of a cell.
+        max_gap: See :func:`~lamin_usecases.atlas.coalesce_rows`.
+        max_workers: The number of files that are processed concurrently.
+
+    Returns:
+        An `AnnData` with the rows of `cells` in the same order as `.obs` and the
+        images in `.obsm["single_cell_images"]`. `.var` and `.uns` hold the
+        channels and metadata of the first file, which `scportrait.pl` needs.
+    """
+    import anndata as ad
+    import h5py
+
+    keys = list(pd.unique(cells[by]))
+    rows_by_key = {key: np.flatnonzero((cells[by] == key).to_numpy()) for key in keys}
+    cell_ids = cells[CELL_ID_KEY].to_numpy()
+
+    opened: list[h5py.File] = []
+
+    def select(key: Any) -> _H5scSelection:
+        f = h5py.File(open_file(key), mode="r")
+        opened.append(f)
+        rows = rows_by_key[key]
+        return _H5scSelection(f, cell_ids[rows], rows)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            selections = list(executor.map(select, keys))
+            if not selections:
+                raise ValueError("cells is empty")
+            first = selections[0]
+            shape, dtype = first.images.shape[1:], first.images.dtype
+            for selection in selections[1:]:
+                if selection.images.shape[1:] != shape:
+                    raise ValueError(
+                        f"image shapes {selection.images.shape[1:]} and {shape} differ"
+                    )
+            out = np.empty((len(cells), *shape), dtype=dtype)
+            list(executor.map(lambda s: s.read_into(out, max_gap), selections))
+            var = read_elem(first.f["var"])
+            uns = read_elem(first.f["uns"]) if "uns" in first.f else {}
+        finally:
+            for f in opened:
+                f.close()
+
+    obs = cells.reset_index(drop=True)
+    obs.index = obs.index.astype(str)
+    return ad.AnnData(obs=obs, var=var, uns=uns, obsm={IMAGES_KEY: out})
+
+
+def _scalar(value: Any) -> Any:
+    # label features with a single value may come back as a collection
+    if isinstance(value, set | frozenset | list | tuple) and len(value) == 1:
+        return next(iter(value))
+    return value
+
+
+def fov_inputs(
+    images: pd.DataFrame,
+    *,
+    by: Sequence[str] = ("cell_line_clone", "stimulation", "FOV"),
+    channel: str = "channel",
+    channels: Sequence[str] = ("DAPI", "Alexa488", "mCherry"),
+    uid: str = "uid",
+) -> dict[str, list[Any]]:
+    """Group the images of an experiment by field of view.
+
+    Args:
+        images: One row per image with the columns `by`, `channel` and `uid`,
+            e.g., from `artifacts.to_dataframe(features=True)`.
+        by: The columns that identify a field of view.
+        channel: The column with the channel of an image.
+        channels: The channels that every field of view must have, in the order
+            in which they're passed to scPortrait.
+        uid: The column that identifies an image.
+
+    Returns:
+        The uids of the images of every field of view in the order of `channels`,
+        keyed by an id like `"clone_1/14h_Torin-1/FOV1"`.
+    """
+    images = images[[*by, channel, uid]].map(_scalar)
+    fovs = {}
+    for values, group in images.groupby(list(by), sort=True):
+        fov_id = "/".join(str(value) for value in values).replace(" ", "_")
+        by_channel = group.set_index(channel)[uid]
+        if not by_channel.index.is_unique or set(by_channel.index) != set(channels):
+            raise ValueError(
+                f"{fov_id} has channels {by_channel.index.tolist()}, "
+                f"expected {list(channels)}"
+            )
+        fovs[fov_id] = by_channel[list(channels)].tolist()
+    return fovs
+
+
+def segment_and_extract(
+    project_location: str | Path,
+    config_path: str | Path,
+    image_paths: Sequence[str | Path],
+    channel_names: Sequence[str],
+) -> str:
+    """Segment the cells of a field of view and extract single-cell images.
+
+    Runs the scPortrait cytosol segmentation with Cellpose and the HDF5
+    extraction into a new project at `project_location`, which is returned.
+    Reopen it with `Project(project_location, ..., overwrite=False)` to access
+    `project.h5sc` and `project.filehandler.get_sdata()`.
+    """
+    from scportrait.pipeline.extraction import HDF5CellExtraction
+    from scportrait.pipeline.project import Project
+    from scportrait.pipeline.segmentation.workflows import CytosolSegmentationCellpose
+
+    Path(project_location).mkdir(parents=True, exist_ok=True)
+    project = Project(
+        project_location=str(project_location),
+        config_path=str(config_path),
+        segmentation_f=CytosolSegmentationCellpose,
+        extraction_f=HDF5CellExtraction,
+        overwrite=True,
+    )
+    project.load_input_from_tif_files(
+        [str(path) for path in image_paths],
+        overwrite=True,
+        channel_names=list(channel_names),
+    )
+    project.segment()
+    project.extract()
+    return str(project_location)
+
+
+def _available_memory() -> int:
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES")
+
+
+_THREAD_VARIABLES = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+
+@contextmanager
+def _limit_threads(n_threads: int) -> Iterator[None]:
+    """Limit the threads of the numerical libraries of the processes spawned inside.
+
+    The variables are read when a library is loaded. An initializer of the pool
+    runs too late: unpickling it imports this package, and hence numpy, first.
+    Spawned processes inherit the environment of the parent at their start, so
+    it is set around the pool and restored afterwards.
+    """
+    previous = {name: os.environ.get(name) for name in _THREAD_VARIABLES}
+    os.environ.update(dict.fromkeys(_THREAD_VARIABLES, str(n_threads)))
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def process_fovs(
+    image_paths: Mapping[str, Sequence[str | Path]],
+    config_path: str | Path,
+    output_directory: str | Path,
+    *,
+    register: Callable[[list[tuple[str, str]]], None],
+    channel_names: Sequence[str] = ("DAPI", "Alexa488", "mCherry"),
+    batch_size: int = 8,
+    max_workers: int | None = None,
+    memory_per_fov: int = 8 * 2**30,
+    max_memory: int | None = None,
+    threads_per_worker: int = 1,
+    process: Callable[..., str] = segment_and_extract,
+) -> int:
+    """Process many fields of view with scPortrait in a process pool.
+
+    Each field of view is processed in its own worker process into
+    `output_directory/<fov id>/scportrait_project`. The number of workers is
+    capped such that `memory_per_fov` times the number of workers stays below
+    `max_memory`, which defaults to the memory that is currently available.
+
+    Workers don't access the database: the finished projects are passed to
+    `register` in the main process, in batches of `batch_size`, while the
+    remaining fields of view are being processed. To resume after an
+    interruption, leave out the fields of view whose outputs are registered.
+    Fields of view that fail don't stop the others; a `RuntimeError` is raised
+    after all others are registered.
+
+    Args:
+        image_paths: The local paths of the images of every field of view, e.g.,
+            those of :func:`fov_inputs` after `artifact.cache()`.
+        config_path: The scPortrait config.
+        output_directory: Where to create the scPortrait projects.
+        register: Called with a list of `(fov_id, project_location)`.
+        channel_names: The names of the channels of the images.
+        batch_size: The number of projects passed to `register` at once.
+        max_workers: The maximal number of worker processes; defaults to the
+            number of CPUs divided by `threads_per_worker`.
+        memory_per_fov: The memory a worker needs to process a field of view.
+        max_memory: The memory all workers may use together.
+        threads_per_worker: The number of threads of numerical libraries per worker.
+        process: The function that processes a field of view, called with the
+            arguments of :func:`segment_and_extract`. It must be importable, as
+            it runs in a spawned process.
+
+    Returns:
+        The number of processed fields of view.
+    """
+    if not image_paths:
+        return 0
+    if max_workers is None:
+        max_workers = max(1, (os.cpu_count() or 1) // threads_per_worker)
+    if max_memory is None:
+        max_memory = _available_memory()
+    n_workers = min(max_workers, max_memory // memory_per_fov, len(image_paths))
+    if n_workers < 1:
+        raise MemoryError(
+            f"processing a field of view needs {memory_per_fov} bytes, "
+            f"but only {max_memory} are available"
+        )
+
+    batch: list[tuple[str, str]] = []
+    failed: dict[str, BaseException] = {}
+    n_processed = 0
+    # spawn, because forking a process that runs threads, e.g., of torch, can hang
+    with (
+        _limit_threads(threads_per_worker),
+        ProcessPoolExecutor(
+            max_workers=n_workers, mp_context=multiprocessing.get_context("spawn")
+        ) as executor,
+    ):
+        futures = {
+            executor.submit(
+                process,
+                Path(output_directory) / fov_id / "scportrait_project",
+                config_path,
+                paths,
+                channel_names,
+            ): fov_id
+            for fov_id, paths in image_paths.items()
+        }
+        for future in as_completed(futures):
+            fov_id = futures[future]
+            try:
+                batch.append((fov_id, future.result()))
+            except Exception as e:  # keep going, so that the other outputs are saved
+                failed[fov_id] = e
+                continue
+            if len(batch) == batch_size:
+                register(batch)
+                n_processed += len(batch)
+                batch = []
+    if batch:
+        register(batch)
+        n_processed += len(batch)
+    if failed:
+        fov_id, error = next(iter(failed.items()))
+        raise RuntimeError(
+            f"{len(failed)} fields of view failed, e.g., {fov_id}: {error!r}"
+        ) from error
+    return n_processed
@@ -0,0 +1,96 @@
+"""Read and write the elements of `.h5ad`-like stores across anndata versions."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+    from scipy.sparse import csr_matrix
+
+
+def _anndata_io():
+    try:
+        import anndata.io as io
+    except ImportError:  # anndata < 0.11
+        import anndata.experimental as io
+    return io
+
+
+def read_elem(elem: Any) -> Any:
+    return _anndata_io().read_elem(elem)
+
+
+def write_elem(group: Any, key: str, value: Any, **kwargs) -> None:
+    _anndata_io().write_elem(group, key, value, **kwargs)
+
+
+def encoding(elem: Any) -> str:
+    """The encoding of an array, `"array"` for dense ones."""
+    if hasattr(elem, "dtype"):  # an h5py.Dataset or a zarr.Array
+        return "array"
+    attrs = elem.attrs
+    if "encoding-type" in attrs:
+        return str(attrs["encoding-type"])
+    # files written by anndata < 0.8
+    legacy = attrs.get("h5sparse_format")
+    return f"{legacy}_matrix" if legacy is not None else "unknown"
+
+
+def coalesce_rows(positions: np.ndarray, max_gap: int = 0) -> list[tuple[int, int]]:
+    """Merge sorted row positions into ranges `[start, stop)`.
+
+    Positions that are at most `max_gap` rows apart end up in the same range,
+    trading reading a few unneeded rows for fewer, larger reads.
+    """
+    if len(positions) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(positions) > max_gap + 1) + 1
+    starts = positions[np.concatenate([[0], breaks])]
+    stops = positions[np.concatenate([breaks - 1, [len(positions) - 1]])] + 1
+    return list(zip(starts.tolist(), stops.tolist(), strict=True))
+
+
+def read_row_ranges(
+    X: Any, ranges: Sequence[tuple[int, int]]
+) -> np.ndarray | csr_matrix:
+    """Read the rows `[start, stop)` of each range of a dense or csr array.
+
+    Each range is read with one contiguous request per underlying array. The
+    rows of all ranges are concatenated in the order of `ranges`.
+
+    Raises:
+        ValueError: If `X` is neither dense nor csr; csc matrices can only be
+            row-sliced by reading most of the matrix.
+    """
+    kind = encoding(X)
+    if kind == "array":
+        if not ranges:
+            return np.asarray(X[0:0])
+        return np.concatenate([X[start:stop] for start, stop in ranges])
+    if kind != "csr_matrix":
+        raise ValueError(f"can only read rows of csr or dense arrays, got {kind}")
+    from scipy.sparse import csr_matrix, vstack
+
+    n_vars = int(X.attrs["shape"][1])
+    indptr = X["indptr"]
+    blocks = []
+    for start, stop in ranges:
+        block_indptr = indptr[start : stop + 1]
+        data_slice = slice(int(block_indptr[0]), int(block_indptr[-1]))
+        blocks.append(
+            csr_matrix(
+                (
+                    X["data"][data_slice],
+                    X["indices"][data_slice],
+                    block_indptr - block_indptr[0],
+                ),
+                shape=(stop - start, n_vars),
+            )
+        )
+    if not blocks:
+        return csr_matrix((0, n_vars), dtype=X["data"].dtype)
+    return blocks[0] if len(blocks) == 1 else vstack(blocks, format="csr")
@@ -0,0 +1,315 @@
+"""Block-wise sampling and prefetching for `MappedCollection`."""
+
+from __future__ import annotations
+
+import queue
+import threading
+from typing import TYPE_CHECKING, Any
+
+import numpy as np
+import pandas as pd
+
+from ._io import coalesce_rows, read_row_ranges
+
+if TYPE_CHECKING:
+    from collections.abc import (
+        Callable,
+        Generator,
+        Iterable,
+        Iterator,
+        Mapping,
+        Sequence,
+    )
+
+    import torch
+    from lamindb.core import MappedCollection
+
+
+class BlockShuffleSampler:
+    """Weighted sampler that yields blocks of nearby rows within one file.
+
+    For every epoch, `num_samples` indices are drawn with the same distribution
+    as in `torch.utils.data.WeightedRandomSampler`. The indices are then sorted,
+    cut into blocks of up to `block_size` indices that never span two files,
+    and the blocks are yielded in random order. The rows of a block hence lie in
+    a single backed file and nearby rows are read together.
+
+    Args:
+        n_obs_list: The number of observations per file, e.g., `dataset.n_obs_list`.
+        weights: Sampling weights per observation, e.g., from
+            `dataset.get_label_weights()`; uniform sampling if `None`.
+        num_samples: The number of samples per epoch; defaults to all observations.
+        block_size: The maximal number of indices per block.
+        replacement: Whether to draw with replacement.
+        seed: Seed of the random number generator.
+    """
+
+    def __init__(
+        self,
+        n_obs_list: Sequence[int],
+        weights: Sequence[float] | np.ndarray | None = None,
+        num_samples: int | None = None,
+        block_size: int = 256,
+        replacement: bool = True,
+        seed: int | None = None,
+    ):
+        self.offsets = np.concatenate([[0], np.cumsum(n_obs_list)])
+        n_obs = int(self.offsets[-1])
+        if weights is not None:
+            weights = np.asarray(weights, dtype=np.float64)
+            if len(weights) != n_obs:
+                raise ValueError(f"got {len(weights)} weights for {n_obs} observations")
+            weights = weights / weights.sum()
+        self.weights = weights
+        self.num_samples = n_obs if num_samples is None else num_samples
+        if not replacement and self.num_samples > n_obs:
+            raise ValueError("num_samples can't exceed the number of observations")
+        self.block_size = block_size
+        self.replacement = replacement
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self) -> int:
+        return self.num_samples
+
+    def draw(self) -> np.ndarray:
+        """Draw the sorted indices of one epoch."""
+        n_obs = int(self.offsets[-1])
+        if self.weights is None and not self.replacement:
+            indices = self.rng.permutation(n_obs)[: self.num_samples]
+        else:
+            indices = self.rng.choice(
+                n_obs, self.num_samples, replace=self.replacement, p=self.weights
+            )
+        return np.sort(indices)
+
+    def blocks(self, indices: np.ndarray) -> list[np.ndarray]:
+        """Cut sorted indices into blocks that stay within one file."""
+        return _split_blocks(indices, self.offsets, self.block_size)
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        blocks = self.blocks(self.draw())
+        for i in self.rng.permutation(len(blocks)):
+            yield blocks[i]
+
+
+def _split_blocks(
+    indices: np.ndarray, offsets: np.ndarray, block_size: int
+) -> list[np.ndarray]:
+    # cut sorted indices into blocks of at most block_size that stay within one file
+    bounds = np.searchsorted(indices, offsets[1:-1])
+    blocks: list[np.ndarray] = []
+    for file_indices in np.split(indices, bounds):
+        n_blocks = -(-len(file_indices) // block_size)
+        blocks += np.array_split(file_indices, n_blocks) if n_blocks else []
+    return blocks
+
+
+def _read_rows(lazy_data: Any, obs_idx: np.ndarray, max_gap: int) -> np.ndarray:
+    # obs_idx is sorted; rows that are at most max_gap apart are read together, so
+    # that a block whose indices are far apart doesn't read all rows in between
+    positions = np.unique(obs_idx)
+    ranges = coalesce_rows(positions, max_gap)
+    values = read_row_ranges(lazy_data, ranges)
+    covered = np.concatenate([np.arange(start, stop) for start, stop in ranges])
+    block = values[np.searchsorted(covered, obs_idx)]
+    return block if isinstance(block, np.ndarray) else block.toarray()
+
+
+class _MappedLayout:
+    """What's needed to read blocks of a `MappedCollection` without its connections.
+
+    Holds only arrays, paths and labels so that it can be pickled to worker processes.
+    """
+
+    def __init__(self, dataset: MappedCollection, max_gap: int = 64):
+        self.max_gap = max_gap
+        self.path_list = list(dataset.path_list)
+        self.offsets = np.concatenate([[0], np.cumsum(dataset.n_obs_list)])
+        self.indices = dataset.indices
+        self.storage_idx = dataset.storage_idx
+        self.join_vars = dataset.join_vars
+        self.var_indices = dataset.var_indices
+        self.n_vars = dataset.n_vars
+        # labels are small, so we hold them in memory instead of reading per row
+        self.labels = {}
+        for label_key in dataset.obs_keys or []:
+            labels = dataset.get_merged_labels(label_key)
+            if label_key in dataset.encoders:
+                encoder = dataset.encoders[label_key]
+                labels = pd.Series(labels).map(encoder).to_numpy()
+            self.labels[label_key] = labels
+
+    def read_block(
+        self, storages: Mapping[int, Any] | Sequence[Any], indices: np.ndarray
+    ) -> dict[str, np.ndarray]:
+        """Read the rows of a block of sorted indices within one file."""
+        storage_idx = int(self.storage_idx[indices[0]])
+        X = _read_rows(storages[storage_idx]["X"], self.indices[indices], self.max_gap)
+        if self.join_vars == "inner":
+            X = X[:, self.var_indices[storage_idx]]
+        elif self.join_vars == "outer":
+            X_outer = np.zeros((len(X), self.n_vars), dtype=X.dtype)
+            X_outer[:, self.var_indices[storage_idx]] = X
+            X = X_outer
+        block = {"X": X, "_store_idx": np.full(len(indices), storage_idx)}
+        for label_key, labels in self.labels.items():
+            block[label_key] = labels[indices]
+        return block
+
+
+def _prefetch(
+    read: Callable[[np.ndarray], dict[str, np.ndarray]],
+    blocks: Iterable[np.ndarray],
+    prefetch: int,
+) -> Generator[dict[str, np.ndarray], None, None]:
+    """Read blocks in a background thread that keeps at most `prefetch` of them."""
+    buffer: queue.Queue = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+
+    def put(item: Any) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for indices in blocks:
+                if not put(read(indices)):
+                    return
+            put(None)
+        except Exception as e:  # surface errors in the consuming thread
+            put(e)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while (block := buffer.get()) is not None:
+            if isinstance(block, Exception):
+                raise block
+            yield block
+    finally:
+        stop.set()
+        producer.join()
+
+
+def _batches(
+    blocks: Generator[dict[str, np.ndarray], None, None],
+    rng: np.random.Generator,
+    batch_size: int,
+    mix_blocks: int,
+) -> Iterator[dict[str, torch.Tensor | list]]:
+    """Shuffle the rows of `mix_blocks` consecutive blocks together into batches."""
+    pending: list[dict[str, np.ndarray]] = []
+    exhausted = False
+    try:
+        while not exhausted:
+            window = pending
+            for _ in range(mix_blocks):
+                block = next(blocks, None)
+                if block is None:
+                    exhausted = True
+                    break
+                window.append(block)
+            if not window:
+                break
+            rows = {
+                key: np.concatenate([block[key] for block in window])
+                for key in window[0]
+            }
+            order = rng.permutation(len(rows["X"]))
+            n_batched = len(order)
+            if not exhausted:
+                n_batched -= n_batched % batch_size
+            for start in range(0, n_batched, batch_size):
+                batch_idx = order[start : start + batch_size]
+                yield {
+                    key: _to_torch(values[batch_idx]) for key, values in rows.items()
+                }
+            # rows that don't fill a batch are mixed into the next window
+            rest = order[n_batched:]
+            pending = (
+                [{key: values[rest] for key, values in rows.items()}]
+                if len(rest) > 0
+                else []
+            )
+    finally:
+        blocks.close()
+
+
+def _to_torch(values: np.ndarray) -> torch.Tensor | list:
+    import torch
+
+    # like the default collate function of a DataLoader, keep strings as a list
+    if values.dtype.kind in "biuf":
+        return torch.from_numpy(values)
+    return values.tolist()
+
+
+class BlockShuffleLoader:
+    """Iterate over batches of a `MappedCollection` using block reads.
+
+    Blocks from a :class:`BlockShuffleSampler` are read and decoded in a
+    background thread that keeps at most `prefetch` blocks in a buffer. The
+    rows of `mix_blocks` consecutive blocks are shuffled together before they
+    are cut into batches, so that batches mix several files.
+
+    Batches are dictionaries of tensors with the same keys as the items of the
+    `MappedCollection`: `"X"`, the `obs_keys` of the dataset and `"_store_idx"`.
+    Labels in `dataset.encoders` are encoded; the connections of the dataset
+    must be open (`parallel=False`).
+
+    Args:
+        dataset: The mapped collection.
+        sampler: The block sampler; defaults to a uniform
+            :class:`BlockShuffleSampler` over the entire dataset.
+        batch_size: The number of rows per batch.
+        mix_blocks: The number of blocks that are shuffled together.
+        prefetch: The maximal number of decoded blocks held in the buffer.
+        max_gap: Rows of a block that are at most `max_gap` rows apart are read
+            with one request, see :func:`~lamin_usecases.atlas.coalesce_rows`.
+            Hence, a block reads at most `(max_gap + 1) * block_size` rows.
+    """
+
+    def __init__(
+        self,
+        dataset: MappedCollection,
+        sampler: BlockShuffleSampler | None = None,
+        batch_size: int = 128,
+        mix_blocks: int = 8,
+        prefetch: int = 16,
+        max_gap: int = 64,
+    ):
+        if dataset.parallel:
+            raise ValueError("the dataset needs open connections, pass parallel=False")
+        self.dataset = dataset
+        self.sampler = (
+            BlockShuffleSampler(dataset.n_obs_list) if sampler is None else sampler
+        )
+        self.batch_size = batch_size
+        self.mix_blocks = mix_blocks
+        self.prefetch = prefetch
+        self.layout = _MappedLayout(dataset, max_gap)
+
+    def __len__(self) -> int:
+        return -(-len(self.sampler) // self.batch_size)
+
+    def read_block(self, indices: np.ndarray) -> dict[str, np.ndarray]:
+        """Read the rows of a block of sorted indices within one file."""
+        return self.layout.read_block(self.dataset.storages, indices)
+
+    def __iter__(self) -> Iterator[dict[str, torch.Tensor | list]]:
+        blocks = _prefetch(self.read_block, self.sampler, self.prefetch)
+        return _batches(blocks, self.sampler.rng, self.batch_size, self.mix_blocks)
+
+
+def __getattr__(name: str) -> Any:
+    # subclasses torch.utils.data.IterableDataset, import torch only when needed
+    if name == "ShardedBlockDataset":
+        from ._mapped_sharded import ShardedBlockDataset
+
+        return ShardedBlockDataset
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
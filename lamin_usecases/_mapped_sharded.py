@@ -0,0 +1,188 @@
+"""Rank- and worker-aware sharding of `MappedCollection` with file affinity."""
+
+from __future__ import annotations
+
+import multiprocessing
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+import numpy as np
+from torch.utils.data import IterableDataset, get_worker_info
+
+from ._mapped import _batches, _MappedLayout, _prefetch, _split_blocks
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator, Sequence
+
+    import torch
+    from lamindb.core import MappedCollection
+
+
+def _open_storage(path: Any) -> Any:
+    path = str(path)
+    if Path(path).is_file():
+        import h5py
+
+        return h5py.File(path, mode="r")
+    import zarr
+
+    return zarr.open(path, mode="r")
+
+
+class ShardedBlockDataset(IterableDataset):
+    """Iterable dataset that shards a `MappedCollection` over ranks and workers.
+
+    The observations, ordered by file, are cut into one contiguous range per
+    `DataLoader` worker of each rank, such that all ranges have the same sampling
+    weight. The ranges are the same for every epoch, so that each worker opens
+    only the few files its range overlaps, once, and keeps them open across
+    epochs if the `DataLoader` uses `persistent_workers=True`.
+
+    Every epoch, each worker draws the same global weighted sample seeded by
+    `seed` and the epoch, keeps the indices that fall into its range and reads
+    them in blocks like :class:`~lamin_usecases.mapped.BlockShuffleLoader`. To avoid
+    hangs in collective operations, the indices are truncated so that every rank
+    yields the same number of full batches; the truncated indices are a uniform
+    subset of each worker's share of the global sample.
+
+    Use with `DataLoader(dataset, batch_size=None, num_workers=...)` and call
+    :meth:`set_epoch` before every epoch. Rank and world size default to those of
+    the initialized `torch.distributed` process group.
+
+    Args:
+        dataset: The mapped collection, only used to read the layout and labels.
+        weights: Sampling weights per observation, e.g., from
+            `dataset.get_label_weights()`; uniform sampling if `None`.
+        num_samples: The number of samples per epoch across all ranks;
+            defaults to all observations.
+        batch_size: The number of rows per batch.
+        block_size: The maximal number of indices per block.
+        mix_blocks: The number of blocks that are shuffled together.
+        prefetch: The maximal number of decoded blocks held in the buffer.
+        max_gap: See :class:`~lamin_usecases.mapped.BlockShuffleLoader`.
+        seed: Seed shared by all ranks.
+        rank: The rank of this process.
+        world_size: The number of ranks.
+    """
+
+    def __init__(
+        self,
+        dataset: MappedCollection,
+        weights: Sequence[float] | np.ndarray | None = None,
+        num_samples: int | None = None,
+        batch_size: int = 128,
+        block_size: int = 256,
+        mix_blocks: int = 8,
+        prefetch: int = 16,
+        max_gap: int = 64,
+        seed: int = 0,
+        rank: int | None = None,
+        world_size: int | None = None,
+    ):
+        import torch.distributed as dist
+
+        distributed = dist.is_available() and dist.is_initialized()
+        if rank is None:
+            rank = dist.get_rank() if distributed else 0
+        if world_size is None:
+            world_size = dist.get_world_size() if distributed else 1
+
+        self.layout = _MappedLayout(dataset, max_gap)
+        n_obs = len(self.layout.indices)
+        if weights is None:
+            weights = np.ones(n_obs)
+        weights = np.asarray(weights, dtype=np.float64)
+        if len(weights) != n_obs:
+            raise ValueError(f"got {len(weights)} weights for {n_obs} observations")
+        self.weights = weights / weights.sum()
+        self.num_samples = n_obs if num_samples is None else num_samples
+        self.batch_size = batch_size
+        self.block_size = block_size
+        self.mix_blocks = mix_blocks
+        self.prefetch = prefetch
+        self.seed = seed
+        self.rank = rank
+        self.world_size = world_size
+        # shared with the worker processes, also if they are persistent
+        self._epoch = multiprocessing.Value("i", 0)
+        self._storages: dict[int, Any] = {}
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_storages"] = {}  # open files aren't passed to worker processes
+        return state
+
+    def set_epoch(self, epoch: int) -> None:
+        """Set the epoch that seeds the global sample."""
+        self._epoch.value = epoch
+
+    def shard_edges(self, num_workers: int = 1) -> np.ndarray:
+        """Boundaries of the contiguous index ranges of all shards.
+
+        Shard `rank * num_workers + worker_id` reads the indices from
+        `edges[shard]` to `edges[shard + 1]`.
+        """
+        n_shards = self.world_size * num_workers
+        cumulative = np.cumsum(self.weights)
+        cuts = np.searchsorted(cumulative, np.arange(1, n_shards) / n_shards)
+        return np.concatenate([[0], cuts, [len(self.weights)]])
+
+    def shard_indices(
+        self, epoch: int, worker_id: int = 0, num_workers: int = 1
+    ) -> np.ndarray:
+        """The sorted indices of the global sample that a worker of this rank reads."""
+        edges = self.shard_edges(num_workers)
+        rng = np.random.default_rng([self.seed, epoch])
+        indices = rng.choice(len(self.weights), self.num_samples, p=self.weights)
+        index_shards = np.searchsorted(edges, indices, side="right") - 1
+
+        # every rank computes the batches of all shards from the same global sample,
+        # so all ranks agree on the number of batches without communicating
+        counts = np.bincount(index_shards, minlength=self.world_size * num_workers)
+        n_batches = counts.reshape(self.world_size, num_workers) // self.batch_size
+        target = n_batches.sum(axis=1).min()
+        own = n_batches[self.rank]
+        while own.sum() > target:
+            own[np.argmax(own)] -= 1
+
+        shard = self.rank * num_workers + worker_id
+        # the global sample is in random order, so its head is a uniform subset
+        own_indices = indices[index_shards == shard][: own[worker_id] * self.batch_size]
+        return np.sort(own_indices)
+
+    def _storage(self, storage_idx: int) -> Any:
+        if storage_idx not in self._storages:
+            self._storages[storage_idx] = _open_storage(
+                self.layout.path_list[storage_idx]
+            )
+        return self._storages[storage_idx]
+
+    def _read_block(self, indices: np.ndarray) -> dict[str, np.ndarray]:
+        storage_idx = int(self.layout.storage_idx[indices[0]])
+        return self.layout.read_block(
+            {storage_idx: self._storage(storage_idx)}, indices
+        )
+
+    def close(self) -> None:
+        """Close the files opened by this process."""
+        for storage in self._storages.values():
+            if hasattr(storage, "close"):
+                storage.close()
+        self._storages = {}
+
+    def __iter__(self) -> Iterator[dict[str, torch.Tensor | list]]:
+        worker_info = get_worker_info()
+        worker_id, num_workers = (
+            (0, 1) if worker_info is None else (worker_info.id, worker_info.num_workers)
+        )
+        epoch = self._epoch.value
+        indices = self.shard_indices(epoch, worker_id, num_workers)
+        rng = np.random.default_rng([self.seed, epoch, self.rank, worker_id])
+        blocks = _split_blocks(indices, self.layout.offsets, self.block_size)
+        blocks = [blocks[i] for i in rng.permutation(len(blocks))]
+        return _batches(
+            _prefetch(self._read_block, blocks, self.prefetch),
+            rng,
+            self.batch_size,
+            self.mix_blocks,
+        )
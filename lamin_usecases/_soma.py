@@ -0,0 +1,238 @@
+"""Out-of-core concatenation of `.h5ad` files into a `tiledbsoma.Experiment`."""
+
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import reduce
+from typing import TYPE_CHECKING, Any
+
+import pandas as pd
+
+from ._io import encoding, read_elem, read_row_ranges
+
+if TYPE_CHECKING:
+    from collections.abc import Mapping, Sequence
+    from pathlib import Path
+
+    import anndata as ad
+    import h5py
+
+
+def _column_order(group: h5py.Group) -> pd.Index:
+    return pd.Index(group.attrs.get("column-order", []), dtype=object)
+
+
+def h5ad_columns(path: str | Path) -> dict[str, pd.Index]:
+    """Metadata columns of an `.h5ad` file, read from the HDF5 attributes only.
+
+    Neither `X` nor the `obs`/`var` dataframes are loaded.
+
+    Returns:
+        The columns of `obs`, `var` and, if present, `raw/var`.
+    """
+    import h5py
+
+    with h5py.File(path, mode="r") as f:
+        columns = {
+            "obs": _column_order(f["obs"]),
+            "var": _column_order(f["var"]),
+        }
+        if "raw" in f and "var" in f["raw"]:
+            columns["raw/var"] = _column_order(f["raw/var"])
+    return columns
+
+
+def intersect_h5ad_columns(paths: Sequence[str | Path]) -> dict[str, pd.Index]:
+    """Intersection of the metadata columns of a number of `.h5ad` files.
+
+    `raw/var` is only part of the result if all files have a `.raw` attribute.
+    """
+    columns = [h5ad_columns(path) for path in paths]
+    keys = reduce(set.intersection, [set(c.keys()) for c in columns])
+    return {
+        key: reduce(pd.Index.intersection, [c[key] for c in columns])
+        for key in ("obs", "var", "raw/var")
+        if key in keys
+    }
+
+
+def _prepare_axis(
+    df: pd.DataFrame, columns: pd.Index | None, id_name: str
+) -> pd.DataFrame:
+    if columns is not None:
+        df = df.filter(columns)  # filter columns to intersection
+    df[id_name] = df.index  # tiledbsoma uses this column as an index
+    df.index.name = None
+    return df
+
+
+class _H5adAxes:
+    """The `obs` and `var` dataframes of one `.h5ad` file, prepared for ingestion."""
+
+    def __init__(
+        self,
+        path: str | Path,
+        columns: Mapping[str, pd.Index],
+        obs_id_name: str,
+        var_id_name: str,
+        obs_constants: Mapping[str, Any],
+    ):
+        import h5py
+
+        self.path = path
+        with h5py.File(path, mode="r") as f:
+            obs = read_elem(f["obs"])
+            self.obs = _prepare_axis(obs, columns.get("obs"), obs_id_name)
+            for key, value in obs_constants.items():
+                self.obs[key] = value
+            self.var = _prepare_axis(
+                read_elem(f["var"]), columns.get("var"), var_id_name
+            )
+            self.raw_var = None
+            if "raw/var" in columns:
+                self.raw_var = _prepare_axis(
+                    read_elem(f["raw/var"]), columns["raw/var"], var_id_name
+                )
+            self.obsm_keys = list(f["obsm"].keys()) if "obsm" in f else []
+            # dataframes can't be row-sliced on disk, so read them once; tiledbsoma
+            # only takes arrays in obsm
+            self.obsm_frames = {
+                key: read_elem(f["obsm"][key]).to_numpy()
+                for key in self.obsm_keys
+                if encoding(f["obsm"][key]) == "dataframe"
+            }
+
+    @property
+    def n_obs(self) -> int:
+        return len(self.obs)
+
+    def metadata_only(self) -> ad.AnnData:
+        """An `AnnData` without data matrices, enough to register the file."""
+        import anndata as ad
+        from scipy.sparse import csr_matrix
+
+        adata = ad.AnnData(obs=self.obs, var=self.var)
+        if self.raw_var is not None:
+            # an empty sparse matrix carries the shape without allocating data
+            shape = (self.n_obs, len(self.raw_var))
+            adata.raw = ad.AnnData(
+                X=csr_matrix(shape, dtype="float32"), var=self.raw_var
+            )
+        return adata
+
+    def read_rows(self, start: int, stop: int) -> ad.AnnData:
+        """Read a contiguous block of rows, including `.raw` and `.obsm`."""
+        import anndata as ad
+        import h5py
+
+        with h5py.File(self.path, mode="r") as f:
+            adata = ad.AnnData(
+                X=_read_rows(f["X"], start, stop),
+                obs=self.obs.iloc[start:stop],
+                var=self.var,
+                obsm={
+                    key: self.obsm_frames[key][start:stop]
+                    if key in self.obsm_frames
+                    else _read_rows(f["obsm"][key], start, stop)
+                    for key in self.obsm_keys
+                },
+            )
+            if self.raw_var is not None:
+                adata.raw = ad.AnnData(
+                    X=_read_rows(f["raw/X"], start, stop), var=self.raw_var
+                )
+        return adata
+
+
+def _read_rows(elem: h5py.Dataset | h5py.Group, start: int, stop: int) -> Any:
+    return read_row_ranges(elem, [(start, stop)])
+
+
+def stream_h5ads_to_tiledbsoma(
+    experiment_uri: str,
+    paths: Sequence[str | Path],
+    *,
+    measurement_name: str,
+    obs_id_name: str = "obs_id",
+    var_id_name: str = "var_id",
+    columns: Mapping[str, pd.Index] | None = None,
+    dataset_column: str | None = "dataset",
+    obs_constants: Mapping[str, Any] | None = None,
+    chunk_size: int = 10_000,
+    max_workers: int = 4,
+) -> int:
+    """Concatenate `.h5ad` files into a new `tiledbsoma.Experiment` with bounded memory.
+
+    The files are first registered from their `obs` and `var` dataframes alone.
+    `X`, `raw/X` and `.obsm` are then read in blocks of `chunk_size` rows and
+    written by a pool of `max_workers` threads, so that at most `max_workers`
+    blocks are in memory at any time. Dataframes in `.obsm` are read in full once
+    per file and stored as arrays. `.obsp`, `.varm` and `.uns` aren't ingested.
+
+    Args:
+        experiment_uri: Where to create the experiment.
+        paths: Local paths of the `.h5ad` files, e.g., from `artifact.cache()`.
+        measurement_name: The name of the measurement to store the data in.
+        obs_id_name: Column to hold the `obs` index.
+        var_id_name: Column to hold the `var` index.
+        columns: Columns to keep in `obs`, `var` and `raw/var`, e.g., from
+            :func:`intersect_h5ad_columns`; defaults to the intersection over `paths`.
+        dataset_column: Column in `obs` that holds the position of the file in `paths`.
+        obs_constants: Further constant columns to add to `obs`.
+        chunk_size: Number of rows read and written at once.
+        max_workers: Number of writer threads.
+
+    Returns:
+        The number of observations in the experiment.
+    """
+    import tiledbsoma.io
+
+    if columns is None:
+        columns = intersect_h5ad_columns(paths)
+    axes = []
+    for i, path in enumerate(paths):
+        constants = {} if dataset_column is None else {dataset_column: i}
+        constants.update(obs_constants or {})
+        axes.append(_H5adAxes(path, columns, obs_id_name, var_id_name, constants))
+
+    registration_mapping = tiledbsoma.io.register_anndatas(
+        None,
+        [axes_.metadata_only() for axes_ in axes],
+        measurement_name=measurement_name,
+        obs_field_name=obs_id_name,
+        var_field_name=var_id_name,
+        append_obsm_varm=True,
+    )
+    write_kwargs = {
+        "measurement_name": measurement_name,
+        "obs_id_name": obs_id_name,
+        "var_id_name": var_id_name,
+        "uns_keys": [],
+    }
+    # the schema is created from a single row before any parallel writes
+    tiledbsoma.io.from_anndata(
+        experiment_uri,
+        axes[0].read_rows(0, 1),
+        ingest_mode="schema_only",
+        **write_kwargs,
+    )
+    registration_mapping.prepare_experiment(experiment_uri)
+
+    def write_chunk(axes_: _H5adAxes, start: int) -> None:
+        adata = axes_.read_rows(start, min(start + chunk_size, axes_.n_obs))
+        tiledbsoma.io.from_anndata(
+            experiment_uri,
+            adata,
+            registration_mapping=registration_mapping,
+            **write_kwargs,
+        )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(write_chunk, axes_, start)
+            for axes_ in axes
+            for start in range(0, axes_.n_obs, chunk_size)
+        ]
+        for future in futures:
+            future.result()
+    return sum(axes_.n_obs for axes_ in axes)
@@ -0,0 +1,251 @@
+"""Cache the results of analysis steps on `AnnData` by a hash of their inputs."""
+
+from __future__ import annotations
+
+import hashlib
+import inspect
+import json
+import weakref
+from collections.abc import Mapping
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+import numpy as np
+import pandas as pd
+
+from ._io import read_elem, write_elem
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Sequence
+
+    import anndata as ad
+
+DELTA_SLOTS = ("obs", "var", "obsm", "varm", "obsp", "varp", "uns")
+# slots whose entries are stored individually, only if they changed
+_MAPPING_SLOTS = ("obsm", "varm", "obsp", "varp")
+
+
+def _update_hash(h: Any, value: Any) -> None:
+    from scipy.sparse import issparse
+
+    if issparse(value):
+        if value.format not in ("csr", "csc"):
+            value = value.tocsr()
+        h.update(f"{value.format}{value.shape}".encode())
+        for array in (value.data, value.indices, value.indptr):
+            h.update(np.ascontiguousarray(array).data)
+    elif isinstance(value, pd.DataFrame):
+        h.update(pd.util.hash_pandas_object(value, index=True).to_numpy().data)
+        h.update(json.dumps(list(map(str, value.columns))).encode())
+    elif isinstance(value, Mapping):
+        for name in sorted(value, key=str):
+            h.update(f"{name}\0".encode())
+            _update_hash(h, value[name])
+    elif isinstance(value, np.ndarray) and value.dtype != object:
+        h.update(f"{value.dtype}{value.shape}".encode())
+        h.update(np.ascontiguousarray(value).data)
+    else:  # e.g., the lists of colors that scanpy stores in .uns
+        h.update(repr(value).encode())
+
+
+def _hash(adata: ad.AnnData, matrices: bool = True) -> str:
+    h = hashlib.sha256()
+    if matrices:
+        _update_hash(h, adata.X)
+        _update_hash(h, adata.layers)
+    else:
+        for name, value in [(None, adata.X), *adata.layers.items()]:
+            h.update(f"{name}{id(value)}{getattr(value, 'shape', None)}".encode())
+    for slot in DELTA_SLOTS:
+        h.update(f"{slot}\0".encode())
+        _update_hash(h, getattr(adata, slot))
+    return h.hexdigest()
+
+
+def content_hash(adata: ad.AnnData) -> str:
+    """Hash the data matrix, the layers and the annotations of an `AnnData`."""
+    return _hash(adata)
+
+
+def _fingerprint(adata: ad.AnnData) -> str:
+    """Hash the annotations; `X` and the layers only by identity, as they are large."""
+    return _hash(adata, matrices=False)
+
+
+def _source(func: Callable) -> str:
+    try:
+        return inspect.getsource(func)
+    except (OSError, TypeError):  # e.g., a builtin
+        return f"{func.__module__}.{func.__qualname__}"
+
+
+class StageCache:
+    """Run analysis steps on `AnnData` as stages whose results are cached.
+
+    A stage is a function that modifies an `AnnData` in place or returns a new
+    one. Its result is stored under a hash of its input, its source code and
+    its parameters. The input is identified by the hash of the stage that
+    produced it or, for data that doesn't come from a stage or was modified
+    since, by :func:`content_hash`. Hence, changing the parameters of a stage
+    reruns that stage and all subsequent ones while the earlier ones are loaded.
+
+    Modifications of a result between stages, e.g., the colors that plotting
+    stores in `.uns`, are detected by hashing its annotations. `X` and the
+    layers are only compared by identity, so assign new matrices rather than
+    changing their values in place.
+
+    Stages that only change annotations, like the PCA or the neighborhood
+    graph, can pass `delta` to store only the slots they write, e.g.,
+    `["obsm", "varm", "uns"]`, instead of the full `.h5ad`. Of `obsm`, `varm`,
+    `obsp` and `varp`, only the entries that the stage added or replaced are
+    stored. Such results are loaded by applying the stored slots to the result
+    of the previous stage.
+
+    Args:
+        directory: Where to store the results.
+    """
+
+    def __init__(self, directory: str | Path):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # maps id(adata) to a weak reference, the hash of a stage result and the
+        # fingerprint of the result, to detect modifications
+        self._keys: dict[int, tuple[weakref.ref, str, str]] = {}
+        self._last: tuple[str, ad.AnnData] | None = None
+
+    def _unchanged_key(self, adata: ad.AnnData) -> str | None:
+        """The hash of a stage result if `adata` is one and wasn't modified since."""
+        entry = self._keys.get(id(adata))
+        if entry is None or entry[0]() is not adata:
+            return None
+        return entry[1] if _fingerprint(adata) == entry[2] else None
+
+    def key(self, adata: ad.AnnData) -> str:
+        """The hash of an unmodified stage result or the content hash of other data."""
+        key = self._unchanged_key(adata)
+        return content_hash(adata) if key is None else key
+
+    def _remember(self, key: str, adata: ad.AnnData) -> ad.AnnData:
+        self._keys = {i: e for i, e in self._keys.items() if e[0]() is not None}
+        self._keys[id(adata)] = (weakref.ref(adata), key, _fingerprint(adata))
+        self._last = (key, adata)
+        return adata
+
+    def _path(self, key: str, delta: bool) -> Path:
+        return self.directory / (f"{key}.delta.h5" if delta else f"{key}.h5ad")
+
+    def is_cached(self, key: str) -> bool:
+        return self._path(key, False).exists() or self._path(key, True).exists()
+
+    def load(self, key: str) -> ad.AnnData:
+        """Load the result of a stage.
+
+        Every call returns a new object, which can be modified without affecting
+        the cached result.
+        """
+        import anndata as ad
+        import h5py
+
+        # reuse the last result unless it was modified since
+        if self._last is not None and self._unchanged_key(self._last[1]) == key:
+            return self._remember(key, self._last[1].copy())
+        if self._path(key, False).exists():
+            return self._remember(key, ad.read_h5ad(self._path(key, False)))
+        with h5py.File(self._path(key, True), mode="r") as f:
+            adata = self.load(f.attrs["parent"])
+            for slot in f.attrs["slots"]:
+                if slot not in _MAPPING_SLOTS:
+                    setattr(adata, slot, read_elem(f[slot]))
+                    continue
+                mapping = getattr(adata, slot)
+                for name in f[slot].attrs["removed"]:
+                    del mapping[name]
+                for name in f[slot]:
+                    mapping[name] = read_elem(f[slot][name])
+        return self._remember(key, adata)
+
+    def _save(
+        self,
+        key: str,
+        adata: ad.AnnData,
+        parent: str | None = None,
+        delta: Sequence[str] = (),
+        before: dict[str, dict[str, Any]] | None = None,
+    ) -> None:
+        import h5py
+
+        if not delta:
+            tmp_path = self._path(key, False).with_suffix(".tmp")
+            adata.write_h5ad(tmp_path)
+            tmp_path.replace(self._path(key, False))
+            return
+        tmp_path = self._path(key, True).with_suffix(".tmp")
+        with h5py.File(tmp_path, mode="w") as f:
+            f.attrs["parent"] = parent
+            f.attrs["slots"] = list(delta)
+            for slot in delta:
+                value = getattr(adata, slot)
+                if slot not in _MAPPING_SLOTS:
+                    write_elem(f, slot, value if slot != "uns" else dict(value))
+                    continue
+                group = f.create_group(slot)
+                group.attrs["removed"] = [n for n in before[slot] if n not in value]
+                for name, entry in value.items():
+                    if before[slot].get(name) is not entry:
+                        write_elem(group, name, entry)
+        tmp_path.replace(self._path(key, True))
+
+    def run(
+        self,
+        func: Callable[..., ad.AnnData | None],
+        adata: ad.AnnData | None = None,
+        *,
+        delta: Sequence[str] | None = None,
+        **params: Any,
+    ) -> ad.AnnData:
+        """Run a stage or load its cached result.
+
+        Args:
+            func: Called as `func(adata, **params)`, or as `func(**params)` if
+                `adata` is `None`; gets a copy of `adata`.
+            adata: The input.
+            delta: The slots the stage writes, out of
+                `"obs", "var", "obsm", "varm", "obsp", "varp", "uns"`. If given,
+                only these are stored; `X`, the layers and the shape must not change.
+            **params: The parameters of the stage; must be JSON-serializable or
+                have a stable `repr`.
+
+        Returns:
+            The result of the stage.
+        """
+        delta = list(delta or [])
+        if unknown := set(delta) - set(DELTA_SLOTS):
+            raise ValueError(f"can't store only {sorted(unknown)}, only {DELTA_SLOTS}")
+        if delta and adata is None:
+            raise ValueError("a stage without input can't store a delta")
+        parent = None if adata is None else self.key(adata)
+        h = hashlib.sha256()
+        for part in (parent or "", func.__qualname__, _source(func)):
+            h.update(part.encode())
+            h.update(b"\0")
+        h.update(json.dumps(params, sort_keys=True, default=repr).encode())
+        key = f"{func.__name__}-{h.hexdigest()[:16]}"
+        if self.is_cached(key):
+            return self.load(key)
+
+        before = None
+        if adata is None:
+            result = func(**params)
+        else:
+            if delta and not self.is_cached(parent):
+                self._save(parent, adata)  # a delta needs a stored parent
+            input_copy = adata.copy()
+            before = {slot: dict(getattr(input_copy, slot)) for slot in _MAPPING_SLOTS}
+            result = func(input_copy, **params)
+            result = input_copy if result is None else result
+            if delta and result.shape != adata.shape:
+                raise ValueError(
+                    f"{func.__name__} changed the shape, can't store a delta"
+                )
+        self._save(key, result, parent, delta, before)
+        return self._remember(key, result)
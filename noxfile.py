@@ -99,6 +99,7 @@ def lint(session: nox.Session) -> None:
         "by_ontology",
         "atlases",
         "docs",
+        "benchmarks",
     ],
 )
 def install(session, group):
@@ -149,6 +150,12 @@ def install(session, group):
             run(session, "uv pip install --system cellpose<4")
         case "docs":
             extras += ""
+        case "benchmarks":
+            run(
+                session,
+                f"uv pip install --system pytest-benchmark scanpy torch "
+                f"pytorch-lightning {SPATIALDATA_CONSTRAINT} monai",
+            )
     run(
         session, "uv pip install --system ipywidgets"
     )  # needed to silence the jupyter warning
@@ -180,6 +187,17 @@ def build(session, group):
     if group == "by_ontology":
         run(session, "python ./scripts/entity_generation/generate.py")
     run(session, f"pytest -s ./tests/test_notebooks.py::test_{group}")
+    if group == "by_datatype":
+        run(
+            session,
+            "pytest -s ./tests/test_mapped.py ./tests/test_cache.py"
+            " ./tests/test_atlas.py ./tests/test_cytometry.py ./tests/test_bulk.py"
+            " ./tests/test_h5mu.py ./tests/test_soma.py",
+        )
+    if group == "templates":
+        run(session, "pytest -s ./tests/test_stages.py")
+    if group == "by_datatype_sc_imaging":
+        run(session, "pytest -s ./tests/test_imaging.py")
 
     # move artifacts into right place
     target_dir = Path(f"./docs_{group}")
@@ -188,6 +206,20 @@ def build(session, group):
         shutil.copy(Path("docs") / filename, target_dir / filename)
 
 
+@nox.session
+def benchmarks(session):
+    # every run is saved under .benchmarks/ in a file named after the commit
+    args = "--benchmark-only --benchmark-autosave"
+    if any(Path(".benchmarks").glob("*/*.json")):
+        # report the changes relative to the last saved run; the timings of shared
+        # runners vary too much to fail on them, set BENCHMARK_COMPARE_FAIL, e.g.,
+        # to "median:25%" on a dedicated runner
+        args += " --benchmark-compare"
+        if compare_fail := os.getenv("BENCHMARK_COMPARE_FAIL"):
+            args += f" --benchmark-compare-fail={compare_fail}"
+    run(session, f"pytest ./benchmarks {args}")
+
+
 @nox.session
 def docs(session):
     # move artifacts into right place
@@ -0,0 +1,88 @@
+import sys
+from pathlib import Path
+
+import anndata as ad
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as pds
+import pyarrow.parquet as pq
+import pytest
+import scipy.sparse as sp
+
+sys.path[:0] = [str(Path(__file__).parent.parent)]
+
+from lamin_usecases import atlas
+
+
+def write_h5ad(path, X):
+    n_obs, n_vars = X.shape
+    adata = ad.AnnData(
+        X=X,
+        obs=pd.DataFrame(index=[f"cell{i}" for i in range(n_obs)]),
+        var=pd.DataFrame(index=[f"gene{j}" for j in range(n_vars)]),
+    )
+    adata.write_h5ad(path)
+    return path
+
+
+@pytest.fixture
+def X():
+    rng = np.random.default_rng(0)
+    return sp.random(
+        40, 7, density=0.3, format="csr", dtype=np.float32, random_state=rng
+    )
+
+
+def test_coalesce_rows():
+    assert atlas.coalesce_rows(np.array([], dtype=int)) == []
+    positions = np.array([1, 2, 3, 7, 8, 20])
+    assert atlas.coalesce_rows(positions) == [(1, 4), (7, 9), (20, 21)]
+    assert atlas.coalesce_rows(positions, max_gap=3) == [(1, 9), (20, 21)]
+    assert atlas.coalesce_rows(positions, max_gap=100) == [(1, 21)]
+
+
+@pytest.mark.parametrize("dense", [False, True])
+def test_read_h5ad_rows(tmp_path, X, dense):
+    path = write_h5ad(tmp_path / "test.h5ad", X.toarray() if dense else X)
+    for max_gap in (0, 4, 100):
+        adata = atlas.read_h5ad_rows(path, positions=[30, 1, 5], max_gap=max_gap)
+        assert adata.obs_names.tolist() == ["cell1", "cell5", "cell30"]
+        values = adata.X if dense else adata.X.toarray()
+        np.testing.assert_array_equal(values, X[[1, 5, 30]].toarray())
+
+    adata = atlas.read_h5ad_rows(path, ["cell8", "cell2"])
+    assert adata.obs_names.tolist() == ["cell2", "cell8"]
+    assert adata.var_names.tolist() == [f"gene{j}" for j in range(7)]
+    with pytest.raises(KeyError, match="cell99"):
+        atlas.read_h5ad_rows(path, ["cell2", "cell99"])
+    with pytest.raises(ValueError, match="either"):
+        atlas.read_h5ad_rows(path)
+
+
+def test_read_h5ad_rows_csc(tmp_path, X):
+    path = write_h5ad(tmp_path / "test.h5ad", X.tocsc())
+    with pytest.raises(ValueError, match="csc_matrix"):
+        atlas.read_h5ad_rows(path, positions=[1, 5, 30])
+
+
+def test_query_parquet(tmp_path):
+    df = pd.DataFrame(
+        {
+            "dataset": ["a", "a", "b", "b", "c"],
+            "cell_name": ["A549", "HepG2", "A549", "A549", "HepG2"],
+            "obs_name": ["cell0", "cell1", "cell0", "cell1", "cell0"],
+            "drug": ["x", "y", "x", "z", "x"],
+        }
+    )
+    pq.write_table(pa.Table.from_pandas(df), tmp_path / "obs.parquet", row_group_size=2)
+    groups = atlas.query_parquet(
+        pds.dataset(tmp_path / "obs.parquet"),
+        (pc.field("cell_name") == "A549") & (pc.field("drug") == "x"),
+        by="dataset",
+        columns=["obs_name"],
+    )
+    assert sorted(groups) == ["a", "b"]
+    assert groups["a"]["obs_name"].tolist() == ["cell0"]
+    assert groups["b"].columns.tolist() == ["obs_name"]
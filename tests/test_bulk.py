@@ -0,0 +1,50 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path[:0] = [str(Path(__file__).parent.parent)]
+
+from lamin_usecases import bulk
+
+
+@pytest.fixture
+def counts_tsv(tmp_path):
+    rng = np.random.default_rng(0)
+    counts = rng.integers(0, 1000, (23, 4)).astype(np.float32) + 0.5
+    df = pd.DataFrame(counts, columns=[f"sample{i}" for i in range(4)])
+    df.insert(0, "gene_name", [f"GENE{i}" for i in range(23)])
+    df.insert(0, "gene_id", [f"ENSG{i:011d}" for i in range(23)])
+    path = tmp_path / "salmon.merged.gene_counts.tsv"
+    df.to_csv(path, sep="\t", index=False)
+    return path, df
+
+
+def test_read_counts(counts_tsv):
+    path, df = counts_tsv
+    adata = bulk.read_counts(path, chunk_size=5)
+    assert adata.X.dtype == np.float32
+    assert adata.X.flags.c_contiguous
+    assert adata.obs_names.tolist() == ["sample0", "sample1", "sample2", "sample3"]
+    assert adata.var_names.tolist() == df.gene_id.tolist()
+    assert adata.var.gene_name.tolist() == df.gene_name.tolist()
+    np.testing.assert_array_equal(adata.X, df.iloc[:, 2:].to_numpy().T)
+
+
+def test_read_count_matrix_subset(counts_tsv, tmp_path):
+    path, df = counts_tsv
+    gz_path = tmp_path / "counts.tsv.gz"
+    df.to_csv(gz_path, sep="\t", index=False)
+    for p in (path, gz_path):
+        counts, var, samples = bulk.read_count_matrix(
+            p, samples=["sample3", "sample1"], chunk_size=10
+        )
+        assert counts.shape == (23, 2)
+        assert samples.tolist() == ["sample3", "sample1"]
+        np.testing.assert_array_equal(counts, df[["sample3", "sample1"]].to_numpy())
+        assert var.columns.tolist() == ["gene_id", "gene_name"]
+
+    with pytest.raises(ValueError, match="metadata columns"):
+        next(bulk.iter_counts(path, metadata_columns=["Geneid"]))
@@ -0,0 +1,165 @@
+import re
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import anndata as ad
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+import scipy.sparse as sp
+
+sys.path[:0] = [str(Path(__file__).parent.parent)]
+
+pytest.importorskip("aiohttp")  # required by fsspec for http
+
+from lamin_usecases import atlas, cache
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    """Serve files from `directory` with support for range requests."""
+
+    directory: Path
+    requests: list
+
+    def log_message(self, format, *args):
+        pass
+
+    def _content(self):
+        path = self.directory / self.path.lstrip("/")
+        if not path.is_file():
+            self.send_error(404)
+            return None
+        return path.read_bytes()
+
+    def do_HEAD(self):
+        content = self._content()
+        if content is None:
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(content)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", f'"{hash(content)}"')
+        self.end_headers()
+
+    def do_GET(self):
+        content = self._content()
+        if content is None:
+            return
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if match is None:
+            self.requests.append((self.path, 0, len(content)))
+            self.send_response(200)
+            body = content
+        else:
+            start = int(match[1])
+            stop = int(match[2]) + 1 if match[2] else len(content)
+            stop = min(stop, len(content))
+            self.requests.append((self.path, start, stop))
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {start}-{stop - 1}/{len(content)}"
+            )
+            body = content[start:stop]
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("served")
+    X = sp.random(2000, 300, density=0.1, format="csr", dtype=np.float32)
+    adata = ad.AnnData(
+        X=X,
+        obs=pd.DataFrame(index=[f"cell{i}" for i in range(2000)]),
+        var=pd.DataFrame(index=[f"gene{i}" for i in range(300)]),
+    )
+    adata.write_h5ad(directory / "adata.h5ad")
+    df = pd.DataFrame({"plate": np.repeat(["p1", "p2"], 1000), "value": range(2000)})
+    pq.write_table(pa.Table.from_pandas(df), directory / "obs.parquet")
+
+    handler = type(
+        "Handler", (RangeRequestHandler,), {"directory": directory, "requests": []}
+    )
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}", handler, adata, df
+    httpd.shutdown()
+
+
+def test_h5ad_through_cache(server, tmp_path):
+    url, handler, adata, _ = server
+    block_cache = cache.BlockCache(tmp_path, block_size=2**14)
+    handler.requests.clear()
+    positions = np.arange(100, 2000, 7)
+    with block_cache.open(f"{url}/adata.h5ad") as f:
+        subset = atlas.read_h5ad_rows(f, positions=positions)
+    np.testing.assert_array_equal(subset.X.toarray(), adata.X[positions].toarray())
+    n_requests = len(handler.requests)
+    assert n_requests > 0
+    # every byte is fetched at most once
+    fetched = sorted((start, stop) for _, start, stop in handler.requests)
+    assert all(a[1] <= b[0] for a, b in zip(fetched, fetched[1:], strict=False))
+
+    # a second read of the same rows is served from disk
+    with cache.BlockCache(tmp_path, block_size=2**14).open(f"{url}/adata.h5ad") as f:
+        subset = atlas.read_h5ad_rows(f, positions=positions)
+    assert len(handler.requests) == n_requests
+    assert subset.n_obs == len(positions)
+
+
+def test_parquet_through_cache(server, tmp_path):
+    url, _, _, df = server
+    block_cache = cache.BlockCache(tmp_path, block_size=2**12)
+    with block_cache.open(f"{url}/obs.parquet") as f:
+        table = pq.read_table(f, columns=["value"], filters=[("plate", "=", "p2")])
+    assert table["value"].to_pylist() == df["value"][df["plate"] == "p2"].tolist()
+
+
+def test_lru_eviction(server, tmp_path):
+    url, handler, _, _ = server
+    block_size = 2**12
+    block_cache = cache.BlockCache(
+        tmp_path, max_bytes=4 * block_size, block_size=block_size, recent_blocks=0
+    )
+    with block_cache.open(f"{url}/adata.h5ad") as f:
+        for index in range(8):
+            f.seek(index * block_size)
+            f.read(block_size)
+        assert block_cache.size <= 4 * block_size
+        handler.requests.clear()
+        # the most recently used blocks are still cached
+        f.seek(7 * block_size)
+        f.read(block_size)
+        assert not handler.requests
+        # the least recently used ones were evicted
+        f.seek(0)
+        f.read(block_size)
+        assert handler.requests
+
+
+def test_size_accounting(server, tmp_path):
+    url, _, _, _ = server
+    block_size = 2**12
+    block_cache = cache.BlockCache(
+        tmp_path, max_bytes=10 * block_size, block_size=block_size, recent_blocks=0
+    )
+    with block_cache.open(f"{url}/adata.h5ad") as f:
+        f.read(3 * block_size)
+        assert block_cache.size == 3 * block_size
+        # storing a block again doesn't count it twice
+        block_cache._store(f.key, 0, b"x" * block_size)
+        assert block_cache.size == 3 * block_size
+        # once full, the cache is evicted down to its low-water mark
+        f.seek(0)
+        f.read(11 * block_size)
+        assert block_cache.size <= 9 * block_size
+    sizes = [path.stat().st_size for path in block_cache._block_paths()]
+    assert block_cache.size == sum(sizes)
+    assert cache.BlockCache(tmp_path, block_size=block_size).size == sum(sizes)
@@ -0,0 +1,182 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path[:0] = [str(Path(__file__).parent.parent)]
+
+from lamin_usecases import cytometry
+
+
+def write_fcs(
+    path: Path,
+    events: np.ndarray,
+    channels: list[tuple[str, str]],
+    dtype: str = "<f4",
+    ranges: list[int] | None = None,
+) -> None:
+    """Write a minimal FCS 3.0 file with `float32` or unsigned integer events."""
+    data_type = np.dtype(dtype)
+    keywords = {
+        "$BYTEORD": "1,2,3,4" if data_type.byteorder != ">" else "4,3,2,1",
+        "$DATATYPE": "I" if data_type.kind == "u" else "F",
+        "$MODE": "L",
+        "$NEXTDATA": "0",
+        "$PAR": str(len(channels)),
+        "$TOT": str(len(events)),
+        "$CYT": "test cytometer",
+    }
+    for i, (channel, marker) in enumerate(channels, start=1):
+        keywords[f"$P{i}N"] = channel
+        keywords[f"$P{i}B"] = str(8 * data_type.itemsize)
+        keywords[f"$P{i}E"] = "0,0"
+        keywords[f"$P{i}R"] = str(ranges[i - 1] if ranges else 262144)
+        if marker:
+            keywords[f"$P{i}S"] = marker
+    # offsets of the DATA segment have a fixed width, so that TEXT has a fixed size
+    keywords["$BEGINDATA"] = keywords["$ENDDATA"] = "0" * 10
+    text_start = 58
+    text = "|" + "".join(f"{key}|{value}|" for key, value in keywords.items())
+    data_start = text_start + len(text)
+    data = events.astype(data_type).tobytes()
+    data_stop = data_start + len(data) - 1
+    text = text.replace(
+        "$BEGINDATA|0000000000", f"$BEGINDATA|{data_start:010d}"
+    ).replace("$ENDDATA|0000000000", f"$ENDDATA|{data_stop:010d}")
+    header = (
+        b"FCS3.0    "
+        + f"{text_start:8d}{text_start + len(text) - 1:8d}".encode()
+        + f"{data_start:8d}{data_stop:8d}".encode()
+        + f"{0:8d}{0:8d}".encode()
+    )
+    path.write_bytes(header + text.encode() + data)
+
+
+class Registry:
+    """Stands in for `bt.CellMarker`."""
+
+    markers = {"CD3", "CD4", "CD8"}
+
+    @classmethod
+    def standardize(cls, values, return_mapper=False):
+        return {value: value.upper() for value in values if value.lower() == value}
+
+    @classmethod
+    def validate(cls, values, mute=False):
+        return np.array([value in cls.markers for value in values])
+
+
+@pytest.fixture
+def fcs_files(tmp_path):
+    rng = np.random.default_rng(0)
+    panels = {
+        "a": [("Time", ""), ("FL1-A", "cd3"), ("FL2-A", "CD4")],
+        "b": [("Time", ""), ("FL1-A", "CD3"), ("FL3-A", "CD8"), ("SSC-A", "")],
+    }
+    files = {}
+    for key, channels in panels.items():
+        events = rng.random((1000 + len(channels), len(channels))).astype(np.float32)
+        write_fcs(tmp_path / f"{key}.fcs", events, channels)
+        files[key] = (tmp_path / f"{key}.fcs", events)
+    return files
+
+
+def test_fcs_header(fcs_files):
+    path, events = fcs_files["b"]
+    header = cytometry.FcsHeader(path)
+    assert header.n_events == len(events)
+    assert header.names == ["Time", "CD3", "CD8", "SSC-A"]
+    np.testing.assert_array_equal(np.concatenate(list(header.iter_events(300))), events)
+
+
+@pytest.mark.parametrize("dtype", ["<u2", ">u4"])
+def test_fcs_header_integers(tmp_path, dtype):
+    rng = np.random.default_rng(0)
+    values = rng.integers(0, 1000, (500, 3))
+    flags = rng.integers(0, 2, (500, 3)) << 12  # set bits above the range
+    path = tmp_path / "integers.fcs"
+    # the ranges round up to the masks 1023, 1023 and 4095
+    channels = [("Time", ""), ("FL1-A", "CD3"), ("FL2-A", "CD4")]
+    write_fcs(path, values + flags, channels, dtype, ranges=[1024, 1000, 4096])
+    header = cytometry.FcsHeader(path)
+    events = np.concatenate(list(header.iter_events(128)))
+    np.testing.assert_array_equal(events, values)
+
+
+def test_fcs_header_matches_readfcs(tmp_path, fcs_files):
+    readfcs = pytest.importorskip("readfcs")
+
+    # synthetic files of every datatype that FcsHeader reads, no download needed
+    rng = np.random.default_rng(0)
+    channels = [("Time", ""), ("FL1-A", "CD3"), ("FL2-A", "CD4")]
+    paths = [fcs_files["b"][0]]
+    for dtype in ("<u2", ">u4"):
+        paths.append(tmp_path / f"integers{dtype[-1]}.fcs")
+        events = rng.integers(0, 2**16, (500, 3))
+        write_fcs(paths[-1], events, channels, dtype, ranges=[1024, 1000, 65536])
+    for path in paths:
+        header = cytometry.FcsHeader(path)
+        expected = readfcs.read(path)
+        assert header.names == expected.var_names.tolist()
+        np.testing.assert_array_equal(
+            np.concatenate(list(header.iter_events(10_000))),
+            expected.X.astype(np.float32),
+        )
+
+
+def test_fcs_store(fcs_files, tmp_path):
+    paths = {key: path for key, (path, _) in fcs_files.items()}
+    panels = cytometry.read_panels(paths)
+    rename, markers, others = cytometry.validate_panels(panels, Registry)
+    assert rename == {"cd3": "CD3"}
+    assert markers == ["CD3", "CD4", "CD8"]
+    assert others == ["SSC-A", "Time"]
+
+    store = cytometry.FcsStore(tmp_path / "events.zarr", chunk_size=256)
+    assert store.append({"a": paths["a"]}, rename=rename, markers=markers) == ["a"]
+    # a second batch adds the marker CD8 and the channel SSC-A
+    assert store.append(paths, rename=rename, markers=markers, cofactor=5) == ["b"]
+    assert store.append(paths, rename=rename, markers=markers) == []
+
+    store = cytometry.FcsStore(tmp_path / "events.zarr")
+    assert [file["id"] for file in store.files] == ["a", "b"]
+    assert all(file["complete"] for file in store.files)
+    assert store.files[1]["cytometer"] == "test cytometer"
+    adata = store.to_anndata()
+    assert adata.var_names.tolist() == ["CD3", "CD4", "CD8"]
+    assert adata.obs.columns.tolist() == ["Time", "SSC-A", "file"]
+    events_a, events_b = fcs_files["a"][1], fcs_files["b"][1]
+    assert adata.n_obs == len(events_a) + len(events_b)
+
+    a = adata[adata.obs.file == "a"]
+    np.testing.assert_array_equal(a.X[:, :2], events_a[:, 1:])
+    assert np.isnan(a.X[:, 2]).all()
+    np.testing.assert_array_equal(a.obs.Time, events_a[:, 0])
+    assert a.obs["SSC-A"].isna().all()
+
+    b = store.to_anndata(["b"])
+    np.testing.assert_allclose(
+        b.X[:, [0, 2]], np.arcsinh(events_b[:, 1:3] / 5), rtol=1e-6
+    )
+    assert np.isnan(b.X[:, 1]).all()
+    np.testing.assert_array_equal(b.obs["SSC-A"], events_b[:, 3])
+
+
+def test_fcs_store_resumes_incomplete_files(fcs_files, tmp_path):
+    paths = {key: path for key, (path, _) in fcs_files.items()}
+    store = cytometry.FcsStore(tmp_path / "events.zarr", chunk_size=256)
+    store.append(paths, markers=["CD3", "CD4", "CD8"])
+    # simulate an interruption while "a" was written
+    files = store.files
+    files[0]["complete"] = False
+    store.group.attrs["files"] = files
+    store.group["X"][: files[0]["stop"]] = 0
+
+    assert store.append(paths, markers=["CD3", "CD4", "CD8"]) == ["a"]
+    assert store.files[0]["start"] == 0
+    assert store.n_events == sum(len(events) for _, events in fcs_files.values())
+    # without renaming, "cd3" isn't a marker
+    a = store.to_anndata(["a"])
+    np.testing.assert_array_equal(a.X[:, 1], fcs_files["a"][1][:, 2])
+    np.testing.assert_array_equal(a.obs["cd3"], fcs_files["a"][1][:, 1])
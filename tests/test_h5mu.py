@@ -0,0 +1,81 @@
+import sys
+from pathlib import Path
+
+import anndata as ad
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.sparse import csr_matrix
+
+sys.path[:0] = [str(Path(__file__).parent.parent)]
+
+from lamin_usecases import h5mu
+
+mudata = pytest.importorskip("mudata")
+
+
+@pytest.fixture
+def h5mu_path(tmp_path):
+    obs_names = [f"cell{i}" for i in range(5)]
+    rna = ad.AnnData(
+        csr_matrix(np.arange(15, dtype=np.float32).reshape(5, 3)),
+        obs=pd.DataFrame({"nCount_RNA": np.arange(5)}, index=obs_names),
+        var=pd.DataFrame(index=["CD4", "CD8A", "FOO"]),
+    )
+    hto = ad.AnnData(
+        np.ones((5, 2), dtype=np.float32),
+        obs=pd.DataFrame({"technique": ["ECCITE-seq"] * 5}, index=obs_names),
+        var=pd.DataFrame(index=["HTO1", "HTO2"]),
+    )
+    mdata = mudata.MuData({"rna": rna, "hto": hto})
+    mdata.obs["replicate"] = ["rep1", "rep2", "rep1", "rep2", "rep1"]
+    mdata.uns["study"] = "test"
+    path = tmp_path / "test.h5mu"
+    mdata.write(path)
+    return path
+
+
+def test_lazy_mudata(h5mu_path):
+    with h5mu.LazyMuData(h5mu_path) as mdata:
+        assert list(mdata) == ["rna", "hto"]
+        rna = mdata["rna"]
+        assert rna.shape == (5, 3)
+        assert rna.obs["nCount_RNA"].tolist() == [0, 1, 2, 3, 4]
+        assert rna.var.index.tolist() == ["CD4", "CD8A", "FOO"]
+        assert "X" not in rna.__dict__ and "obs" not in mdata["hto"].__dict__
+        assert rna.X[4, 2] == 14
+        assert mdata.obs["replicate"].tolist()[:2] == ["rep1", "rep2"]
+
+        skeleton = mdata.to_mudata(X=["hto"])
+        assert skeleton["rna"].X is None
+        assert skeleton["rna"].shape == (5, 3)
+        assert skeleton["hto"].X.sum() == 10
+        assert skeleton.uns["study"] == "test"
+        with pytest.raises(KeyError):
+            mdata.to_mudata(X=["adt"])
+    assert not mdata.file
+
+
+def test_write_annotations(h5mu_path, tmp_path):
+    with h5mu.LazyMuData(h5mu_path) as lazy:
+        mdata = lazy.to_mudata(X=False)
+    mdata["rna"].var.index = ["CD4", "CD8A", "BAR"]
+    mdata["rna"].obs["cell_type"] = "T cell"
+    mdata.obs["replicate"] = mdata.obs["replicate"].astype("category")
+
+    target = h5mu.write_annotations(mdata, h5mu_path, tmp_path / "curated.h5mu")
+    curated = mudata.read_h5mu(target)
+    assert curated["rna"].var_names.tolist() == ["CD4", "CD8A", "BAR"]
+    assert (curated["rna"].obs["cell_type"] == "T cell").all()
+    assert curated["rna"].X[4, 2] == 14
+    assert curated["hto"].X.sum() == 10
+    assert "BAR" in curated.var_names
+    assert curated.uns["study"] == "test"
+    # the file is written anew, keeping the user block that marks it as MuData
+    assert target.read_bytes()[:6] == b"MuData"
+    again = h5mu.write_annotations(mdata, target, tmp_path / "again.h5mu")
+    assert again.stat().st_size <= target.stat().st_size
+
+    mdata.mod["hto"] = mdata["hto"][:, :1].copy()
+    with pytest.raises(ValueError, match="shape"):
+        h5mu.write_annotations(mdata, h5mu_path, tmp_path / "wrong.h5mu")
@@ -0,0 +1,163 @@
+import os
+import sys
+from pathlib import Path
+
+import anndata as ad
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path[:0] = [str(Path(__file__).parent.parent)]
+
+from lamin_usecases import imaging
+
+
+def write_h5sc(path: Path, n_cells: int, seed: int) -> ad.AnnData:
+    """Write an `.h5sc` file in the layout of `scportrait`."""
+    rng = np.random.default_rng(seed)
+    adata = ad.AnnData(
+        obs=pd.DataFrame(
+            # cell ids aren't sorted in the file
+            {"scportrait_cell_id": rng.permutation(n_cells) * 10 + seed},
+            index=np.arange(n_cells).astype(str),
+        ),
+        var=pd.DataFrame(
+            {"channel_name": ["mask", "nucleus", "LC3B"]},
+            index=["0", "1", "2"],
+        ),
+        obsm={"single_cell_images": rng.random((n_cells, 3, 8, 8)).astype(np.float16)},
+        uns={"single_cell_images": {"image_size": 8}},
+    )
+    adata.write_h5ad(path)
+    return adata
+
+
+def test_read_h5sc_cells(tmp_path):
+    files = {f"ds{i}": tmp_path / f"ds{i}.h5sc" for i in range(3)}
+    adatas = {
+        key: write_h5sc(path, 200, seed)
+        for seed, (key, path) in enumerate(files.items())
+    }
+    rng = np.random.default_rng(0)
+    selected = []
+    for key, adata in adatas.items():
+        ids = rng.choice(adata.obs.scportrait_cell_id, 25, replace=False)
+        selected.append(pd.DataFrame({"dataset": key, "scportrait_cell_id": ids}))
+    # interleave the files and keep an unrelated index
+    cells = pd.concat(selected).sample(frac=1, random_state=0)
+    cells["score"] = rng.random(len(cells))
+
+    result = imaging.read_h5sc_cells(cells, files.__getitem__, max_workers=2)
+
+    assert result.n_obs == len(cells)
+    assert result.obs.index.tolist() == [str(i) for i in range(len(cells))]
+    np.testing.assert_array_equal(result.obs.score, cells.score)
+    assert result.var.channel_name.tolist() == ["mask", "nucleus", "LC3B"]
+    assert result.uns["single_cell_images"]["image_size"] == 8
+    images = result.obsm["single_cell_images"]
+    assert images.dtype == np.float16
+    for row, (key, cell_id) in enumerate(
+        zip(cells.dataset, cells.scportrait_cell_id, strict=True)
+    ):
+        adata = adatas[key]
+        position = np.flatnonzero(adata.obs.scportrait_cell_id == cell_id)[0]
+        np.testing.assert_array_equal(
+            images[row], adata.obsm["single_cell_images"][position]
+        )
+
+
+def test_read_h5sc_cells_many_ranges(tmp_path):
+    path = tmp_path / "ds.h5sc"
+    adata = write_h5sc(path, 3000, 0)
+    # every third cell, so that every cell is a range of its own, and one twice
+    ids = adata.obs.scportrait_cell_id.to_numpy()[::3]
+    ids = np.concatenate([ids, ids[:1]])
+    rng = np.random.default_rng(1)
+    cells = pd.DataFrame({"dataset": "ds", "scportrait_cell_id": rng.permutation(ids)})
+
+    result = imaging.read_h5sc_cells(cells, {"ds": path}.__getitem__, max_gap=0)
+
+    positions = pd.Index(adata.obs.scportrait_cell_id).get_indexer(
+        cells.scportrait_cell_id
+    )
+    np.testing.assert_array_equal(
+        result.obsm["single_cell_images"], adata.obsm["single_cell_images"][positions]
+    )
+
+
+def test_fov_inputs():
+    images = pd.DataFrame(
+        {
+            "cell_line_clone": ["clone 1"] * 3 + [{"clone 2"}] * 3,
+            "stimulation": ["untreated"] * 6,
+            "FOV": ["FOV1"] * 6,
+            "channel": ["mCherry", "DAPI", "Alexa488"] * 2,
+            "uid": list("abcdef"),
+        }
+    )
+    assert imaging.fov_inputs(images) == {
+        "clone_1/untreated/FOV1": ["b", "c", "a"],
+        "clone_2/untreated/FOV1": ["e", "f", "d"],
+    }
+    with pytest.raises(ValueError, match="clone_1/untreated/FOV1 has channels"):
+        imaging.fov_inputs(images.iloc[1:])
+
+
+def fake_segment_and_extract(project_location, config_path, image_paths, channel_names):
+    if "fails" in str(project_location):
+        raise OSError("corrupt image")
+    Path(project_location).mkdir(parents=True)
+    (Path(project_location) / "channels.txt").write_text(",".join(channel_names))
+    (Path(project_location) / "threads.txt").write_text(
+        os.environ.get("OPENBLAS_NUM_THREADS", "")
+    )
+    return str(project_location)
+
+
+def test_process_fovs(tmp_path):
+    image_paths = {f"clone/untreated/FOV{i}": [f"FOV{i}.tif"] for i in range(5)}
+    batches = []
+    n_processed = imaging.process_fovs(
+        image_paths,
+        "config.yml",
+        tmp_path,
+        register=batches.append,
+        batch_size=2,
+        max_workers=2,
+        memory_per_fov=2**20,
+        threads_per_worker=3,
+        process=fake_segment_and_extract,
+    )
+    assert n_processed == 5
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    registered = dict(pair for batch in batches for pair in batch)
+    assert registered.keys() == image_paths.keys()
+    for fov_id, location in registered.items():
+        assert location == str(tmp_path / fov_id / "scportrait_project")
+        assert (Path(location) / "channels.txt").read_text() == "DAPI,Alexa488,mCherry"
+        # the workers start with the limit, the main process keeps its own
+        assert (Path(location) / "threads.txt").read_text() == "3"
+    assert os.environ.get("OPENBLAS_NUM_THREADS") != "3"
+
+    with pytest.raises(MemoryError):
+        imaging.process_fovs(
+            image_paths,
+            "config.yml",
+            tmp_path,
+            register=batches.append,
+            memory_per_fov=2**30,
+            max_memory=2**29,
+        )
+
+    batches = []
+    with pytest.raises(RuntimeError, match="1 fields of view failed"):
+        imaging.process_fovs(
+            {"fails": ["FOV.tif"], "works": ["FOV.tif"]},
+            "config.yml",
+            tmp_path,
+            register=batches.append,
+            max_workers=2,
+            memory_per_fov=2**20,
+            process=fake_segment_and_extract,
+        )
+    assert batches == [[("works", str(tmp_path / "works" / "scportrait_project"))]]
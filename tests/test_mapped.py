@@ -0,0 +1,141 @@
+import sys
+from collections import Counter
+from pathlib import Path
+
+import anndata as ad
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.sparse as sp
+
+sys.path[:0] = [str(Path(__file__).parent.parent)]
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("lamindb")
+
+import torch.distributed as dist
+from lamin_usecases import mapped
+from lamindb.core import MappedCollection
+from torch.utils.data import DataLoader
+
+WORLD_SIZE = 2
+NUM_WORKERS = 2
+
+
+@pytest.fixture(scope="module")
+def paths(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("mapped")
+    rng = np.random.default_rng(0)
+    paths = []
+    for i, n_obs in enumerate([300, 120, 500, 80, 250]):
+        X = sp.random(n_obs, 30, density=0.2, format="csr", dtype=np.float32)
+        # the first column holds the global row number to check what was read
+        X = X.tolil()
+        X[:, 0] = np.arange(n_obs)[:, None] + 1000 * i
+        obs = pd.DataFrame(
+            {"cell_type": pd.Categorical(rng.choice(["a", "b", "c"], n_obs))},
+            index=[f"file{i}_cell{j}" for j in range(n_obs)],
+        )
+        path = directory / f"file{i}.h5ad"
+        ad.AnnData(X=X.tocsr(), obs=obs).write_h5ad(path)
+        paths.append(path)
+    return paths
+
+
+def test_block_shuffle_loader(paths):
+    with MappedCollection(paths, obs_keys=["cell_type"]) as dataset:
+        offsets = np.concatenate([[0], np.cumsum(dataset.n_obs_list)])
+        sampler = mapped.BlockShuffleSampler(
+            dataset.n_obs_list, weights=dataset.get_label_weights("cell_type"), seed=0
+        )
+        loader = mapped.BlockShuffleLoader(dataset, sampler, batch_size=64)
+        n_rows = 0
+        for batch in loader:
+            store_idx = batch["_store_idx"].numpy()
+            rows = offsets[store_idx] + batch["X"][:, 0].numpy().astype(int) % 1000
+            for row, x, label in zip(rows, batch["X"], batch["cell_type"], strict=True):
+                item = dataset[int(row)]
+                np.testing.assert_array_equal(x.numpy(), item["X"])
+                assert label == item["cell_type"]
+            n_rows += len(rows)
+        assert n_rows == len(dataset)
+        assert sum(1 for _ in loader) == len(loader)
+
+
+def _run_rank(rank, paths, init_file):
+    dist.init_process_group(
+        "gloo", init_method=f"file://{init_file}", rank=rank, world_size=WORLD_SIZE
+    )
+    with MappedCollection(paths, obs_keys=["cell_type"], parallel=True) as dataset:
+        weights = dataset.get_label_weights("cell_type")
+        offsets = np.concatenate([[0], np.cumsum(dataset.n_obs_list)])
+        sharded = mapped.ShardedBlockDataset(
+            dataset, weights=weights, batch_size=32, block_size=16
+        )
+    assert sharded.rank == rank and sharded.world_size == WORLD_SIZE
+
+    loader = DataLoader(
+        sharded, batch_size=None, num_workers=NUM_WORKERS, persistent_workers=True
+    )
+    for epoch in range(2):
+        sharded.set_epoch(epoch)
+        rows = []
+        for batch in loader:
+            assert len(batch["X"]) == 32
+            store_idx = batch["_store_idx"].numpy()
+            rows += list(
+                offsets[store_idx] + batch["X"][:, 0].numpy().astype(int) % 1000
+            )
+        shard_indices = [
+            sharded.shard_indices(epoch, worker_id, NUM_WORKERS)
+            for worker_id in range(NUM_WORKERS)
+        ]
+        # the batches contain exactly the rows of the shards of this rank
+        assert Counter(int(i) for i in rows) == Counter(
+            int(i) for i in np.concatenate(shard_indices)
+        )
+        gathered = [None] * WORLD_SIZE
+        dist.all_gather_object(gathered, (len(rows), shard_indices))
+        if rank == 0:
+            n_rows = {n for n, _ in gathered}
+            assert len(n_rows) == 1  # ranks yield the same number of batches
+            rng = np.random.default_rng([0, epoch])
+            sample = Counter(
+                int(i)
+                for i in rng.choice(len(weights), len(weights), p=sharded.weights)
+            )
+            shards = [indices for _, worker in gathered for indices in worker]
+            # shards are disjoint subsets of one global weighted sample
+            assert not Counter(int(i) for s in shards for i in s) - sample
+            # most of the global sample is used
+            assert sum(len(s) for s in shards) > 0.8 * len(weights)
+            # with file affinity, a worker reads from few files
+            for indices in shards:
+                n_files = len(np.unique(np.searchsorted(offsets, indices, "right")))
+                assert n_files <= 2
+    dist.destroy_process_group()
+
+
+def test_read_rows_bounds_span():
+    from lamin_usecases._mapped import _read_rows
+
+    class Recording(np.ndarray):
+        def __getitem__(self, key):
+            if isinstance(key, slice):
+                reads.append(key.stop - key.start)
+            return super().__getitem__(key)
+
+    reads = []
+    X = np.arange(10_000, dtype=np.float32)[:, None].view(Recording)
+    obs_idx = np.array([3, 3, 10, 4_000, 4_050, 9_999])
+    values = _read_rows(X, obs_idx, max_gap=64)
+    np.testing.assert_array_equal(np.asarray(values)[:, 0], obs_idx)
+    assert reads == [8, 51, 1]
+
+
+def test_sharded_block_dataset_gloo(paths, tmp_path):
+    torch.multiprocessing.spawn(
+        _run_rank,
+        args=([str(path) for path in paths], tmp_path / "init"),
+        nprocs=WORLD_SIZE,
+    )
@@ -0,0 +1,108 @@
+import sys
+from pathlib import Path
+
+import anndata as ad
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.sparse as sp
+
+sys.path[:0] = [str(Path(__file__).parent.parent)]
+
+pytest.importorskip("tiledbsoma")
+
+import tiledbsoma
+import tiledbsoma.io
+from lamin_usecases import soma
+
+N_VARS = 12
+
+
+def make_adata(i: int, n_obs: int, obs_columns: dict, var_columns: dict):
+    rng = np.random.default_rng(i)
+    X = sp.random(n_obs, N_VARS, density=0.3, format="csr", dtype=np.float32)
+    X.data = rng.integers(1, 10, X.nnz).astype(np.float32)
+    var_names = [f"gene{j}" for j in range(N_VARS)]
+    adata = ad.AnnData(
+        X=X,
+        obs=pd.DataFrame(
+            {"cell_type": rng.choice(["T", "B"], n_obs), **obs_columns},
+            index=[f"file{i}_cell{j}" for j in range(n_obs)],
+        ),
+        var=pd.DataFrame({"symbol": var_names, **var_columns}, index=var_names),
+        obsm={"X_pca": rng.random((n_obs, 3)).astype(np.float32)},
+    )
+    adata.obsm["qc"] = pd.DataFrame(
+        {"score": rng.random(n_obs).astype(np.float32)}, index=adata.obs_names
+    )
+    adata.raw = adata.copy()
+    adata.X = X.multiply(0.5).tocsr()  # normalized, raw keeps the counts
+    return adata
+
+
+@pytest.fixture
+def adatas():
+    return [
+        make_adata(0, 23, {"donor": "d1"}, {"highly_variable": True}),
+        make_adata(1, 31, {"assay": "10x"}, {"means": 1.0}),
+    ]
+
+
+@pytest.fixture
+def paths(tmp_path, adatas):
+    paths = [tmp_path / f"file{i}.h5ad" for i in range(len(adatas))]
+    for adata, path in zip(adatas, paths, strict=True):
+        adata.write_h5ad(path)
+    return paths
+
+
+def test_intersect_h5ad_columns(paths):
+    assert soma.h5ad_columns(paths[0])["obs"].tolist() == ["cell_type", "donor"]
+    columns = soma.intersect_h5ad_columns(paths)
+    assert columns["obs"].tolist() == ["cell_type"]
+    assert columns["var"].tolist() == ["symbol"]
+    assert columns["raw/var"].tolist() == ["symbol"]
+
+
+def test_stream_h5ads_to_tiledbsoma(tmp_path, paths, adatas):
+    uri = str(tmp_path / "experiment")
+    n_obs = soma.stream_h5ads_to_tiledbsoma(
+        uri,
+        paths,
+        measurement_name="RNA",
+        obs_constants={"lamin_run_uid": "run0"},
+        chunk_size=10,
+        max_workers=2,
+    )
+    assert n_obs == 54
+
+    expected = ad.concat(adatas, merge="same")
+    expected.raw = ad.concat([adata.raw.to_adata() for adata in adatas])
+    with tiledbsoma.Experiment.open(uri) as experiment:
+        obs = experiment.obs.read().concat().to_pandas()
+        result, raw = (
+            tiledbsoma.io.to_anndata(
+                experiment, measurement_name=name, obs_id_name="obs_id"
+            )[expected.obs_names]
+            for name in ("RNA", "raw")
+        )
+    assert set(obs.columns) >= {"obs_id", "cell_type", "dataset", "lamin_run_uid"}
+    assert "donor" not in obs.columns and "assay" not in obs.columns
+    assert sorted(obs["dataset"].unique()) == [0, 1]
+    np.testing.assert_allclose(result.X.toarray(), expected.X.toarray())
+    np.testing.assert_allclose(result.obsm["X_pca"], expected.obsm["X_pca"])
+    np.testing.assert_allclose(
+        np.asarray(result.obsm["qc"]).ravel(), expected.obsm["qc"]["score"]
+    )
+    np.testing.assert_allclose(raw.X.toarray(), expected.raw.X.toarray())
+
+
+def test_stream_h5ads_to_tiledbsoma_rejects_csc(tmp_path, adatas):
+    path = tmp_path / "csc.h5ad"
+    adata = adatas[0]
+    adata.X = adata.X.tocsc()
+    adata.write_h5ad(path)
+    with pytest.raises(ValueError, match="csc_matrix"):
+        soma.stream_h5ads_to_tiledbsoma(
+            str(tmp_path / "experiment"), [path], measurement_name="RNA"
+        )
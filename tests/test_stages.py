@@ -0,0 +1,129 @@
+import sys
+from pathlib import Path
+
+import anndata as ad
+import h5py
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.sparse as sp
+
+sys.path[:0] = [str(Path(__file__).parent.parent)]
+
+from lamin_usecases import stages
+
+calls = []
+
+
+def normalize(adata, target_sum):
+    calls.append("normalize")
+    scale = target_sum / np.asarray(adata.X.sum(axis=1)).ravel()
+    adata.X = sp.csr_matrix(sp.diags(scale) @ adata.X)
+
+
+def embed(adata, n_comps):
+    calls.append("embed")
+    adata.obsm["X_embed"] = np.asarray(adata.X[:, :n_comps].todense())
+    adata.obsp["graph"] = sp.identity(adata.n_obs, format="csr")
+
+
+def cluster(adata, n_clusters):
+    calls.append("cluster")
+    adata.obs["cluster"] = pd.Categorical(np.arange(adata.n_obs) % n_clusters)
+    adata.uns["cluster"] = {"n_clusters": n_clusters}
+
+
+def subset(adata):
+    return adata[:5].copy()
+
+
+@pytest.fixture
+def adata():
+    rng = np.random.default_rng(0)
+    return ad.AnnData(
+        X=sp.csr_matrix(rng.random((20, 10)) + 0.1, dtype=np.float32),
+        obs=pd.DataFrame(index=[f"cell{i}" for i in range(20)]),
+        var=pd.DataFrame(index=[f"gene{i}" for i in range(10)]),
+    )
+
+
+def pipeline(cache, adata, n_clusters):
+    adata = cache.run(normalize, adata, target_sum=10.0)
+    adata = cache.run(embed, adata, delta=["obsm", "obsp"], n_comps=3)
+    return cache.run(cluster, adata, delta=["obs", "uns"], n_clusters=n_clusters)
+
+
+def test_stage_cache(adata, tmp_path):
+    calls.clear()
+    result = pipeline(stages.StageCache(tmp_path), adata, n_clusters=2)
+    assert calls == ["normalize", "embed", "cluster"]
+    assert adata.obs.columns.empty  # the input isn't modified
+
+    # a new session loads all stages from disk
+    calls.clear()
+    loaded = pipeline(stages.StageCache(tmp_path), adata, n_clusters=2)
+    assert calls == []
+    np.testing.assert_allclose(loaded.X.toarray(), result.X.toarray())
+    np.testing.assert_array_equal(loaded.obsm["X_embed"], result.obsm["X_embed"])
+    assert (loaded.obsp["graph"] != result.obsp["graph"]).nnz == 0
+    assert loaded.obs.cluster.tolist() == result.obs.cluster.tolist()
+    assert loaded.uns["cluster"]["n_clusters"] == 2
+
+    # changing the last stage only reruns it
+    calls.clear()
+    result = pipeline(stages.StageCache(tmp_path), adata, n_clusters=3)
+    assert calls == ["cluster"]
+    assert result.uns["cluster"]["n_clusters"] == 3
+
+    # changing the input reruns everything
+    calls.clear()
+    pipeline(stages.StageCache(tmp_path), adata[:10].copy(), n_clusters=3)
+    assert calls == ["normalize", "embed", "cluster"]
+
+    # deltas only contain the new entries
+    full = sorted(tmp_path.glob("*.h5ad"))
+    deltas = sorted(tmp_path.glob("*.delta.h5"))
+    assert [path.name.split("-")[0] for path in full] == ["normalize", "normalize"]
+    assert len(deltas) == 5
+    cluster_delta = next(path for path in deltas if path.name.startswith("cluster"))
+    with h5py.File(cluster_delta) as f:
+        assert set(f.keys()) == {"obs", "uns"}
+
+
+def test_stage_cache_delta_must_keep_shape(adata, tmp_path):
+    cache = stages.StageCache(tmp_path)
+    with pytest.raises(ValueError, match="changed the shape"):
+        cache.run(subset, adata, delta=["obs"])
+    with pytest.raises(ValueError, match="can't store only"):
+        cache.run(subset, adata, delta=["X"])
+
+
+def mark(adata, value):
+    adata.obs["a"] = value
+
+
+def double(adata):
+    adata.obs["b"] = adata.obs["a"] * 2
+
+
+def test_stage_cache_sees_modifications(adata, tmp_path):
+    cache = stages.StageCache(tmp_path)
+    result = cache.run(mark, adata, value=1)
+    result.obs["a"] = 100
+    assert cache.run(double, result).obs["b"].iloc[0] == 200
+
+    # a new session with a different modification doesn't load the result above
+    cache = stages.StageCache(tmp_path)
+    result = cache.run(mark, adata, value=1)
+    assert result.obs["a"].iloc[0] == 1
+    result.obs["a"] = 7
+    assert cache.run(double, result).obs["b"].iloc[0] == 14
+
+    # the cached result isn't affected by modifications of what was returned
+    result = cache.run(mark, adata, value=1)
+    assert result.obs["a"].iloc[0] == 1
+    again = cache.run(mark, adata, value=1)
+    assert again is not result
+    again.uns["colors"] = ["#1f77b4"]
+    assert cache.key(again) != cache.key(result)
+    assert "colors" not in cache.run(mark, adata, value=1).uns